@@ -1,14 +1,24 @@
+import copy
+import io
+import itertools
+import json
 import logging
 import math
+import multiprocessing as mp
 import os
+import queue
+import socket
+import threading
+import time
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
 from tqdm import tqdm
-from collections import deque
-from random import shuffle
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import wandb
 import yaml
 
@@ -18,44 +28,309 @@ logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 
+class EvaluationCache:
+    """
+    LRU cache of network evaluations shared by every MCTS of the process,
+    so positions repeated across games (openings above all) are evaluated
+    once. Keys are (model_version, position key): a network gets a new
+    model_version whenever its weights change, which makes the entries of
+    older weights unreachable until they age out. max_size 0 disables it.
+    A lock makes it safe to share between threads (pipelined self-play).
+    """
+
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def resize(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            while len(self.entries) > max_size:
+                self.entries.popitem(last=False)
+
+    def get(self, key):
+        if self.max_size <= 0:
+            return None
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def log_stats(self):
+        lookups = self.hits + self.misses
+        if lookups:
+            log.info(
+                f"Evaluation cache: {self.hits} hits / {lookups} lookups "
+                f"({self.hits / lookups:.1%}), {len(self.entries)} entries"
+            )
+
+
+evaluation_cache = EvaluationCache()  # sized from args.evalCacheSize by MCTS
+
+_model_versions = itertools.count()
+
+
+def new_model_version():
+    """A token unique across processes, identifying one set of weights"""
+    return (os.getpid(), next(_model_versions))
+
+
+def atomic_save(obj, filepath):
+    """torch.save to a temporary file renamed over filepath, so readers never see a partial file"""
+    torch.save(obj, filepath + ".tmp")
+    os.replace(filepath + ".tmp", filepath)
+
+
+class CheckpointWriter:
+    """
+    Saves checkpoints on a background thread, in submission order, so the
+    training loop does not wait for the disk. wait() blocks until every
+    submitted write has finished and re-raises the first failure.
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.pending = []
+
+    def submit(self, obj, filepath):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self.pending = [f for f in self.pending if not f.done() or f.exception() is not None]
+        self.pending.append(self.executor.submit(atomic_save, obj, filepath))
+
+    def wait(self):
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+
+checkpoint_writer = CheckpointWriter()  # shared, so a load always sees earlier saves
+
+
+class NodePool:
+    """
+    Contiguous storage for the MCTS tree.
+
+    Node i owns row i of every per-edge array, and edges point at their
+    child by row index instead of by board string. Positions reached by
+    different move orders share one node, so the tree is really a DAG.
+
+    With symmetric keys a node also stands for all rotations/reflections
+    of its position. Its rows are then laid out in the frame of the board
+    it was created for, and edge_syms[s, a] is the transform (an index
+    into game.dihedral_perms) from s's frame to the child's frame. Rows are allocated
+    in order and the arrays grow by doubling, so the memory held by a
+    tree is exactly `nbytes`.
+    """
+
+    UNEXPANDED = -1
+    PENDING = -2  # leaf reached in the current round, awaiting the network
+
+    def __init__(self, action_size, capacity=1024):
+        self.action_size = action_size
+        self.capacity = 0
+        self.size = 0  # number of allocated nodes
+
+        self.Nsa = np.zeros((0, action_size), dtype=np.int32)  # #times edge s,a was visited
+        self.Wsa = np.zeros((0, action_size), dtype=np.float32)  # total value backed up through s,a
+        self.Ps = np.zeros((0, action_size), dtype=np.float32)  # initial policy (returned by neural net)
+        self.Vs = np.zeros((0, action_size), dtype=bool)  # game.getValidMoves for node s
+        self.children = np.zeros((0, action_size), dtype=np.int32)  # child index of s,a (or UNEXPANDED/PENDING)
+        self.Ns = np.zeros(0, dtype=np.int32)  # #times node s was visited
+        self.Es = np.zeros(0, dtype=np.float32)  # game.getGameEnded for node s (nan if not terminal)
+        self.keys = np.zeros(0, dtype=np.uint64)  # Zobrist (orbit) key of node s
+        self.orbit_syms = np.zeros(0, dtype=np.int8)  # transform from node s's board to its orbit key
+        self.edge_syms = np.zeros((0, action_size), dtype=np.int8)  # frame change along edge s,a
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        A = self.action_size
+        self.Nsa = np.concatenate([self.Nsa, np.zeros((extra, A), dtype=np.int32)])
+        self.Wsa = np.concatenate([self.Wsa, np.zeros((extra, A), dtype=np.float32)])
+        self.Ps = np.concatenate([self.Ps, np.zeros((extra, A), dtype=np.float32)])
+        self.Vs = np.concatenate([self.Vs, np.zeros((extra, A), dtype=bool)])
+        self.children = np.concatenate(
+            [self.children, np.full((extra, A), self.UNEXPANDED, dtype=np.int32)]
+        )
+        self.Ns = np.concatenate([self.Ns, np.zeros(extra, dtype=np.int32)])
+        self.Es = np.concatenate([self.Es, np.full(extra, np.nan, dtype=np.float32)])
+        self.keys = np.concatenate([self.keys, np.zeros(extra, dtype=np.uint64)])
+        self.orbit_syms = np.concatenate([self.orbit_syms, np.zeros(extra, dtype=np.int8)])
+        self.edge_syms = np.concatenate([self.edge_syms, np.zeros((extra, A), dtype=np.int8)])
+        self.capacity = capacity
+
+    def allocate(self):
+        """Return the index of a fresh, zeroed node."""
+        if self.size == self.capacity:
+            self._grow(2 * self.capacity)
+        node = self.size
+        self.size += 1
+        return node
+
+    def clear(self):
+        """Drop every node, keeping the allocated arrays for reuse."""
+        self._clear_rows(0)
+
+    def _clear_rows(self, start):
+        n = self.size
+        self.Nsa[start:n] = 0
+        self.Wsa[start:n] = 0
+        self.Ps[start:n] = 0
+        self.Vs[start:n] = False
+        self.children[start:n] = self.UNEXPANDED
+        self.Ns[start:n] = 0
+        self.Es[start:n] = np.nan
+        self.keys[start:n] = 0
+        self.orbit_syms[start:n] = 0
+        self.edge_syms[start:n] = 0
+        self.size = start
+
+    def compact(self, root):
+        """
+        Keep only the nodes reachable from root and renumber them from 0 in
+        breadth-first order, so root becomes node 0. Rows past the kept ones
+        are cleared for reuse.
+
+        Returns:
+            the new index of root (always 0)
+        """
+        seen = np.zeros(self.size, dtype=bool)
+        seen[root] = True
+        keep = [np.array([root])]
+        frontier = keep[0]
+        while frontier.size:
+            children = self.children[frontier].ravel()
+            children = np.unique(children[children >= 0])
+            frontier = children[~seen[children]]
+            seen[frontier] = True
+            keep.append(frontier)
+        keep = np.concatenate(keep)
+
+        remap = np.full(self.size, self.UNEXPANDED, dtype=np.int32)
+        remap[keep] = np.arange(len(keep), dtype=np.int32)
+        m = len(keep)
+        for x in self._arrays():
+            x[:m] = x[keep]
+        children = self.children[:m]
+        linked = children >= 0
+        children[linked] = remap[children[linked]]
+        self._clear_rows(m)
+        return 0
+
+    def _arrays(self):
+        return (
+            self.Nsa, self.Wsa, self.Ps, self.Vs, self.children, self.Ns, self.Es,
+            self.keys, self.orbit_syms, self.edge_syms,
+        )
+
+    @property
+    def nbytes(self):
+        return sum(x.nbytes for x in self._arrays())
+
+
 class MCTS:
     """
     This class handles the MCTS tree.
+
+    Simulations run in rounds of up to args.mctsBatchSize. Each descent of a
+    round applies a virtual loss of args.virtualLoss to the edges it takes so
+    that the next descent is steered elsewhere; the leaves reached are then
+    evaluated with a single batched forward pass and backed up together.
+
+    Nodes are looked up in a transposition table keyed by Zobrist hash,
+    holding at most args.tableSize positions (least recently used ones are
+    dropped first; 0 means no limit). With args.symmetricTable the key is
+    the orbit key of the position, so rotated and reflected positions share
+    one node: one network evaluation and one set of statistics. A descent
+    then tracks the transform g from the actual board to the frame of the
+    current node and maps actions through it.
+
+    Network evaluations also go through the process-wide evaluation_cache
+    (args.evalCacheSize entries), keyed by the same position keys, when
+    nnet has a model_version.
+
+    Leaves are encoded (see InputEncoder.encode_board) from the game.Board
+    the descent plays its moves on. With args.input_planes > 1 the network
+    also sees the last move played: the move of the descent for a leaf, the
+    one given to getActionProb for the root. The cache then keys on it as
+    well, but a node shared by transpositions keeps the priors of whichever
+    move order reached it first.
     """
 
-    def __init__(self, game, nnet, args):
+    def __init__(self, game, nnet, args, rng=np.random):
         self.game = game
         self.nnet = nnet
         self.args = args
-        self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
-        self.Nsa = {}  # stores #times edge s,a was visited
-        self.Ns = {}  # stores #times board s was visited
-        self.Ps = {}  # stores initial policy (returned by neural net)
-
-        self.Es = {}  # stores game.getGameEnded for board s
-        self.Vs = {}  # stores game.getValidMoves for board s
-
-    def getActionProb(self, canonicalBoard, temp=1):
+        self.rng = rng  # breaks ties between best moves at temp=0
+        self.tree = NodePool(game.getActionSize(), capacity=2 * args.numMCTSSims + 1)
+        self.root = -1
+        self.root_sym = 0  # transform from the root board to the root node's frame
+        self.table = OrderedDict()  # position key -> its node, in LRU order
+        self.perms = game.getSymmetryPerms()
+        self.encoder = InputEncoder(args.input_planes)
+        evaluation_cache.resize(args.evalCacheSize)
+
+    def getActionProb(self, canonicalBoard, temp=1, last=-1):
         """
         This function performs numMCTSSims simulations of MCTS starting from
         canonicalBoard.
 
+        If canonicalBoard is already in the tree, typically one or two moves
+        below the root of the previous call (our move, or our move followed
+        by the opponent's), the search is re-rooted at that node: its subtree
+        and visit statistics are kept and the rest of the tree is discarded.
+        Otherwise the tree is rebuilt. Between moves the tree is thus bounded
+        by one search worth of nodes plus numMCTSSims new ones.
+
+        last is the opponent's move that led to canonicalBoard, -1 if unknown.
+
         Returns:
             probs: a policy vector where the probability of the ith action is
                    proportional to Nsa[(s,a)]**(1./temp)
         """
-        for _ in range(self.args.numMCTSSims):
-            self.search(canonicalBoard)
+        _, dst, compose, inverse = self.perms
+        board = self.game.makeBoard(canonicalBoard, self.args.symmetricTable, last)
+        key, sym = board.orbit_key(1)
+        root = self._lookup(key)
+        if root < 0 or not np.isnan(self.tree.Es[root]):
+            self.tree.clear()
+            self.root = self.tree.allocate()
+            self.tree.keys[self.root] = key
+            self.tree.orbit_syms[self.root] = sym
+            self.root_sym = 0
+            [(ps, _)] = self._evaluate([(self.encoder.encode_board(board, 1), key, sym, last)])
+            self._expand(self.root, canonicalBoard, ps)
+        else:
+            self.root_sym = compose[inverse[self.tree.orbit_syms[root]]][sym]
+            self.root = self.tree.compact(root)
+        self._rebuild_table()
 
-        s = self.game.stringRepresentation(canonicalBoard)
-        counts = [
-            self.Nsa[(s, a)] if (s, a) in self.Nsa else 0
-            for a in range(self.game.getActionSize())
-        ]
+        batch_size = max(1, self.args.mctsBatchSize)
+        sims = 0
+        while sims < self.args.numMCTSSims:
+            sims += self.search(board, min(batch_size, self.args.numMCTSSims - sims))
+
+        counts = self.tree.Nsa[self.root][dst[self.root_sym]].astype(np.float64)
 
         if temp == 0:
             bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
-            bestA = np.random.choice(bestAs)
+            bestA = self.rng.choice(bestAs)
             probs = [0] * len(counts)
             probs[bestA] = 1
             return probs
@@ -65,84 +340,319 @@ class MCTS:
         probs = [x / counts_sum for x in counts]
         return probs
 
-    def search(self, canonicalBoard):
+    def search(self, board, batch_size=1):
         """
-        This function performs one iteration of MCTS. It is recursively called
-        till a leaf node is found. The action chosen at each node is one that
-        has the maximum upper confidence bound as in the paper.
+        This function performs one round of up to batch_size MCTS simulations
+        from the root node, whose canonical position board (a game.Board)
+        holds. Each simulation descends the tree until an unexpanded edge is
+        found. The action chosen at each node is
+        one that has the maximum upper confidence bound as in the paper.
+
+        The leaf nodes found are evaluated together by the neural network,
+        which returns an initial policy P and a value v for each state. This
+        value is propagated up the search path. In case the leaf node is a
+        terminal state, the outcome is propagated up the search path right
+        away. The values of Ns, Nsa, Wsa are updated.
 
-        Once a leaf node is found, the neural network is called to return an
-        initial policy P and a value v for the state. This value is propagated
-        up the search path. In case the leaf node is a terminal state, the
-        outcome is propagated up the search path. The values of Ns, Nsa, Qsa are
-        updated.
+        A descent that runs into a leaf already waiting for the network ends
+        the round early, so fewer than batch_size simulations may be done.
 
         NOTE: Since v is in [-1,1] and if v is the value of a
         state for the current player, then its value is -v for the other player.
 
         Returns:
-            v: the value of the current canonicalBoard
+            sims: the number of simulations completed
+        """
+        pending = []  # (path, leaf) waiting for the network
+        sims = 0
+
+        for _ in range(batch_size):
+            path, leaf, v = self._descend(board)
+            if path is None:
+                break
+            if leaf is None:
+                self._backup(path, v)
+                sims += 1
+            else:
+                pending.append((path, leaf))
+
+        if pending:
+            evaluations = self._evaluate([leaf[1:5] for _, leaf in pending])
+            for (path, (leaf, _, key, sym, _, g)), (ps, v) in zip(pending, evaluations):
+                node, a = path[-1]
+                # the same position may have been reached by two paths this round
+                child = self._lookup(key)
+                if child < 0:
+                    child = self._allocate(key, sym)
+                    self._expand(child, leaf, ps)
+                self._link(node, a, child, sym, g)
+                self._backup(path, v)
+                sims += 1
+        return sims
+
+    def _evaluate(self, leaves):
+        """
+        Network policy and value for each (input planes, key, sym, last
+        move) in leaves. Cached evaluations are reused and the rest go
+        through a single predict_inputs call. The cache holds policies in the
+        frame of the orbit key, so sym maps them to and from the board's own
+        frame.
+        """
+        src, dst, _, _ = self.perms
+        version = getattr(self.nnet, "model_version", None)
+        results = [None] * len(leaves)
+        keys = [None] * len(leaves)
+        misses = []
+        for i, (_, key, sym, last) in enumerate(leaves):
+            if version is not None:
+                if self.args.input_planes == 1:
+                    keys[i] = (version, key)
+                else:
+                    keys[i] = (version, key, int(dst[sym][last]) if last >= 0 else -1)
+            hit = None if version is None else evaluation_cache.get(keys[i])
+            if hit is None:
+                misses.append(i)
+            else:
+                ps, v = hit
+                results[i] = (ps[dst[sym]], v)
+
+        if misses:
+            pis, vs = self.nnet.predict_inputs(np.stack([leaves[i][0] for i in misses]))
+            for i, ps, v in zip(misses, pis, vs):
+                sym = leaves[i][2]
+                results[i] = (ps, float(v))
+                if version is not None:
+                    evaluation_cache.put(keys[i], (ps[src[sym]], float(v)))
+        return results
+
+    def _lookup(self, key):
+        """Return the node of key from the transposition table, or -1."""
+        node = self.table.get(key, -1)
+        if node >= 0:
+            self.table.move_to_end(key)
+        return node
+
+    def _allocate(self, key, sym):
+        node = self.tree.allocate()
+        self.tree.keys[node] = key
+        self.tree.orbit_syms[node] = sym
+        self.table[key] = node
+        if 0 < self.args.tableSize < len(self.table):
+            self.table.popitem(last=False)
+        return node
+
+    def _rebuild_table(self):
+        """Index the nodes left after a re-root, shallowest most recent."""
+        tree = self.tree
+        nodes = range(tree.size - 1, -1, -1)
+        if self.args.tableSize > 0:
+            nodes = nodes[-self.args.tableSize:]
+        self.table = OrderedDict(zip(tree.keys[list(nodes)].tolist(), nodes))
+
+    def _link(self, node, a, child, sym, g):
+        """
+        Point edge (node, a) at child. g is the transform from the actual
+        board to node's frame, and sym maps the actual board after the move
+        onto the orbit key it shares with child.
         """
+        _, _, compose, inverse = self.perms
+        tree = self.tree
+        child_g = compose[inverse[tree.orbit_syms[child]]][sym]
+        tree.edge_syms[node, a] = compose[child_g][inverse[g]]
+        tree.children[node, a] = child
 
-        s = self.game.stringRepresentation(canonicalBoard)
+    def _descend(self, board):
+        """
+        Walk from the root to a leaf, applying virtual loss along the way.
+        The moves are played in place on board, a game.Board holding the
+        root position, and taken back before returning.
 
-        if s not in self.Es:
-            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
-        if self.Es[s] is not None:
-            # terminal node
-            return self.Es[s]
+        Returns:
+            path: the (node, action) edges taken, or None if the descent ran
+                  into a leaf that is already pending evaluation
+            leaf: for a new leaf, its canonical board, input planes, orbit
+                  key, orbit transform and the move that led to it, and the
+                  frame transform g of its parent;
+                  None if the descent ended in a terminal node
+            v: the value of a terminal leaf for the player to move there
+        """
+        src, _, compose, inverse = self.perms
+        tree = self.tree
+        vl = self.args.virtualLoss
+        node = self.root
+        g = self.root_sym
+        player = 1  # the root board is canonical
+        path = []
+        moves = []  # actions played on board
+        leaf = v = None
 
-        if s not in self.Ps:
-            # leaf node
-            self.Ps[s], v = self.nnet.predict(canonicalBoard)
-            valids = self.game.getValidMoves(canonicalBoard, 1)
-            self.Ps[s] = self.Ps[s] * valids  # masking invalid moves
-            sum_Ps_s = np.sum(self.Ps[s])
-            if sum_Ps_s > 0:
-                self.Ps[s] /= sum_Ps_s  # renormalize
-            else:
-                # if all valid moves were masked make all valid moves equally probable
-                log.error("All valid moves were masked, doing a workaround.")
-                self.Ps[s] = self.Ps[s] + valids
-                self.Ps[s] /= np.sum(self.Ps[s])
-
-            self.Vs[s] = valids
-            self.Ns[s] = 0
-            return v
-
-        valids = self.Vs[s]
-        cur_best = -float("inf")
-        best_act = -1
-
-        # pick the action with the highest upper confidence bound
-        for a in range(self.game.getActionSize()):
-            if valids[a]:
-                u = self.Qsa.get((s, a), 0) + self.args.cpuct * self.Ps[s][
-                    a
-                ] * math.sqrt(self.Ns[s]) / (1 + self.Nsa.get((s, a), 0))
-
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
-
-        a = best_act
-        next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
-        next_s = self.game.getCanonicalForm(next_s, next_player)
-
-        v = -self.search(next_s)
-
-        if (s, a) in self.Qsa:
-            self.Qsa[(s, a)] = (self.Nsa[(s, a)] * self.Qsa[(s, a)] + v) / (
-                self.Nsa[(s, a)] + 1
-            )
-            self.Nsa[(s, a)] += 1
+        while True:
+            a = self._select(node)
+            path.append((node, a))
+            tree.Nsa[node, a] += 1
+            tree.Wsa[node, a] -= vl
+            tree.Ns[node] += 1
+
+            child = tree.children[node, a]
+            if child == NodePool.PENDING:
+                self._revert(path)
+                path = None
+                break
+
+            move = a if g == 0 else int(src[g][a])  # a, on the actual board
+            board.execute_action(move, player)
+            moves.append(move)
+            player = -player
+
+            if child == NodePool.UNEXPANDED:
+                key, sym = board.orbit_key(player)
+                child = self._lookup(key)
+                if child >= 0:
+                    # transposition: the position (or a symmetric one) already has a node
+                    self._link(node, a, child, sym, g)
+                else:
+                    e = board.get_game_ended(player, move)
+                    if e is not None:
+                        # terminal node
+                        child = self._allocate(key, sym)
+                        self._link(node, a, child, sym, g)
+                        tree.Es[child] = e
+                        v = e
+                    else:
+                        # leaf node
+                        tree.children[node, a] = NodePool.PENDING
+                        leaf = (
+                            self.game.getCanonicalForm(board.pieces, player),
+                            self.encoder.encode_board(board, player),
+                            key,
+                            sym,
+                            move,
+                            g,
+                        )
+                    break
+
+            if not np.isnan(tree.Es[child]):
+                # terminal node
+                v = float(tree.Es[child])
+                break
+            g = compose[tree.edge_syms[node, a]][g]
+            node = child
+
+        for a in reversed(moves):
+            board.undo_action(a)
+        return path, leaf, v
+
+    def _backup(self, path, v):
+        """Propagate the leaf value v up path, replacing the virtual loss."""
+        tree = self.tree
+        vl = self.args.virtualLoss
+        for node, a in reversed(path):
+            v = -v
+            tree.Wsa[node, a] += v + vl
+
+    def _revert(self, path):
+        """Undo the virtual loss of an abandoned descent."""
+        tree = self.tree
+        vl = self.args.virtualLoss
+        for node, a in path:
+            tree.Nsa[node, a] -= 1
+            tree.Wsa[node, a] += vl
+            tree.Ns[node] -= 1
+
+    def _select(self, node):
+        """
+        Pick the action with the highest upper confidence bound. The bound is
+        evaluated for every action at once over the node's rows, with invalid
+        moves masked to -inf.
+        """
+        tree = self.tree
+        nsa = tree.Nsa[node]
+        qsa = np.divide(
+            tree.Wsa[node], nsa, out=np.zeros(nsa.shape, dtype=np.float32), where=nsa > 0
+        )
+        u = qsa + self.args.cpuct * tree.Ps[node] * math.sqrt(tree.Ns[node]) / (1 + nsa)
+        return int(np.argmax(np.where(tree.Vs[node], u, -np.inf)))
 
+    def _expand(self, node, canonicalBoard, ps):
+        """
+        Fill in a freshly allocated node for the non-terminal canonicalBoard
+        from the network policy ps.
+        """
+        tree = self.tree
+        valids = self.game.getValidMoves(canonicalBoard, 1)
+        ps = ps * valids  # masking invalid moves
+        sum_ps = np.sum(ps)
+        if sum_ps > 0:
+            ps /= sum_ps  # renormalize
         else:
-            self.Qsa[(s, a)] = v
-            self.Nsa[(s, a)] = 1
+            # if all valid moves were masked make all valid moves equally probable
+            log.error("All valid moves were masked, doing a workaround.")
+            ps = ps + valids
+            ps /= np.sum(ps)
+
+        tree.Ps[node] = ps
+        tree.Vs[node] = valids
+
+
+class InputEncoder:
+    """
+    Turns canonical boards (+1 the player to move, -1 the opponent) and the
+    last move played on each into the network's input planes, the same way
+    for MCTS leaves, training batches and exported models:
+        1 plane: the board as is
+        4 planes: own stones, opponent stones, the last move (all zero when
+                  unknown) and side to move (all ones when the player to
+                  move is the one who started the game)
+    During search the planes come from encode_board, which copies the
+    stone and last move state a game.Board keeps up to date move by move,
+    so nothing is recomputed from the raw board per evaluation. Stored
+    examples (training batches, calibration) are encoded in bulk by encode.
+    """
+
+    def __init__(self, planes):
+        if planes not in (1, 4):
+            raise ValueError("not support input planes {}".format(planes))
+        self.planes = planes
 
-        self.Ns[s] += 1
-        return v
+    def encode(self, boards, lasts=None):
+        """
+        boards: int8 canonical boards, batch_size x n x n
+        lasts: flat index of the last move on each board, -1 if unknown
+        Returns float32 planes, batch_size x planes x n x n
+        """
+        batch_size = len(boards)
+        out = np.empty((batch_size, self.planes) + boards.shape[1:], dtype=np.float32)
+        if self.planes == 1:
+            out[:, 0] = boards
+            return out
+        np.equal(boards, 1, out=out[:, 0])
+        np.equal(boards, -1, out=out[:, 1])
+        out[:, 2] = 0
+        if lasts is not None:
+            known = np.flatnonzero(lasts >= 0)
+            out.reshape(batch_size, self.planes, -1)[known, 2, lasts[known]] = 1
+        stones = np.count_nonzero(boards.reshape(batch_size, -1), axis=1)
+        out[:, 3] = (stones % 2 == 0)[:, None, None]
+        return out
+
+    def encode_board(self, board, player):
+        """
+        The int8 planes (planes x n x n) of the canonical form for player of
+        board, a game.Board, with its last move.
+        """
+        out = np.empty((self.planes,) + board.pieces.shape, dtype=np.int8)
+        if self.planes == 1:
+            np.multiply(board.pieces, player, out=out[0])
+            return out
+        planes = out.reshape(self.planes, -1)
+        own, other = (0, 1) if player == 1 else (1, 0)
+        planes[0] = board.colors[own]
+        planes[1] = board.colors[other]
+        planes[2] = 0
+        if board.last >= 0:
+            planes[2, board.last] = 1
+        planes[3] = board.stones % 2 == 0
+        return out
 
 
 class GomokuNNet(nn.Module):
@@ -152,8 +662,10 @@ class GomokuNNet(nn.Module):
         self.action_size = game.getActionSize()
         self.args = args
 
+        self.in_planes = args.input_planes
+
         super(GomokuNNet, self).__init__()
-        self.conv1 = nn.Conv2d(1, args.num_channels, 3, stride=1, padding=1)
+        self.conv1 = nn.Conv2d(self.in_planes, args.num_channels, 3, stride=1, padding=1)
         self.conv2 = nn.Conv2d(
             args.num_channels, args.num_channels, 3, stride=1, padding=1
         )
@@ -178,10 +690,10 @@ class GomokuNNet(nn.Module):
 
     def forward(self, s):
         # you can add residual to the network
-        #                                                           s: batch_size x board_x x board_y
+        #                                                           s: batch_size x in_planes x board_x x board_y
         s = s.view(
-            -1, 1, self.board_x, self.board_y
-        )  # batch_size x 1 x board_x x board_y
+            -1, self.in_planes, self.board_x, self.board_y
+        )  # batch_size x in_planes x board_x x board_y
         s = F.relu(
             self.bn1(self.conv1(s))
         )  # batch_size x num_channels x board_x x board_y
@@ -194,7 +706,7 @@ class GomokuNNet(nn.Module):
         s = F.relu(
             self.bn4(self.conv4(s))
         )  # batch_size x num_channels x (board_x-4) x (board_y-4)
-        s = s.view(-1, self.args.num_channels * (self.board_x - 4) * (self.board_y - 4))
+        s = s.reshape(-1, self.args.num_channels * (self.board_x - 4) * (self.board_y - 4))
 
         s = F.dropout(
             F.relu(self.fc_bn1(self.fc1(s))),
@@ -212,6 +724,363 @@ class GomokuNNet(nn.Module):
 
         return F.log_softmax(pi, dim=1), torch.tanh(v)
 
+    def fused(self):
+        """
+        An eval-mode copy of the network with every BatchNorm folded into
+        the convolution or linear layer feeding it, for inference only.
+        """
+        net = copy.deepcopy(self).eval()
+        for conv, bn in (("conv1", "bn1"), ("conv2", "bn2"), ("conv3", "bn3"), ("conv4", "bn4")):
+            setattr(net, conv, fuse_conv_bn_eval(getattr(net, conv), getattr(net, bn)))
+            setattr(net, bn, nn.Identity())
+        for fc, bn in (("fc1", "fc_bn1"), ("fc2", "fc_bn2")):
+            setattr(net, fc, fuse_linear_bn_eval(getattr(net, fc), getattr(net, bn)))
+            setattr(net, bn, nn.Identity())
+        return net
+
+
+class ResidualBlock(nn.Module):
+    def __init__(self, channels):
+        super(ResidualBlock, self).__init__()
+        self.conv1 = nn.Conv2d(channels, channels, 3, stride=1, padding=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(channels)
+        self.conv2 = nn.Conv2d(channels, channels, 3, stride=1, padding=1, bias=False)
+        self.bn2 = nn.BatchNorm2d(channels)
+
+    def forward(self, s):
+        out = F.relu(self.bn1(self.conv1(s)))
+        return F.relu(s + self.bn2(self.conv2(out)))
+
+
+class GomokuResNet(nn.Module):
+    """
+    Fully convolutional alternative to GomokuNNet: a 3x3 input convolution,
+    args.num_blocks residual blocks of args.num_channels, a policy head of
+    1x1 convolutions giving one logit per cell and a value head averaging
+    1x1 convolution features over the board. No weight depends on the board
+    size, so parameters and FLOPs per cell stay the same from 9x9 to 15x15.
+    """
+
+    HEAD_CHANNELS = 32  # of the 1x1 convolutions of both heads
+    VALUE_HIDDEN = 128
+
+    def __init__(self, game, args):
+        # game params
+        self.board_x, self.board_y = game.getBoardSize()
+        self.action_size = game.getActionSize()
+        self.args = args
+
+        self.in_planes = args.input_planes
+
+        super(GomokuResNet, self).__init__()
+        self.conv = nn.Conv2d(self.in_planes, args.num_channels, 3, stride=1, padding=1, bias=False)
+        self.bn = nn.BatchNorm2d(args.num_channels)
+        self.blocks = nn.Sequential(*[ResidualBlock(args.num_channels) for _ in range(args.num_blocks)])
+
+        self.policy_conv = nn.Conv2d(args.num_channels, self.HEAD_CHANNELS, 1, bias=False)
+        self.policy_bn = nn.BatchNorm2d(self.HEAD_CHANNELS)
+        self.policy_out = nn.Conv2d(self.HEAD_CHANNELS, 1, 1)
+
+        self.value_conv = nn.Conv2d(args.num_channels, self.HEAD_CHANNELS, 1, bias=False)
+        self.value_bn = nn.BatchNorm2d(self.HEAD_CHANNELS)
+        self.value_fc1 = nn.Linear(self.HEAD_CHANNELS, self.VALUE_HIDDEN)
+        self.value_fc2 = nn.Linear(self.VALUE_HIDDEN, 1)
+
+    def forward(self, s):
+        #                                                           s: batch_size x in_planes x board_x x board_y
+        s = s.view(-1, self.in_planes, s.shape[-2], s.shape[-1])  # batch_size x in_planes x board_x x board_y
+        s = F.relu(self.bn(self.conv(s)))  # batch_size x num_channels x board_x x board_y
+        s = self.blocks(s)  # batch_size x num_channels x board_x x board_y
+
+        pi = F.relu(self.policy_bn(self.policy_conv(s)))
+        pi = self.policy_out(pi).flatten(1)  # batch_size x action_size
+
+        v = F.relu(self.value_bn(self.value_conv(s))).mean(dim=(2, 3))  # batch_size x HEAD_CHANNELS
+        v = self.value_fc2(F.relu(self.value_fc1(v)))  # batch_size x 1
+
+        return F.log_softmax(pi, dim=1), torch.tanh(v)
+
+    def fused(self):
+        """
+        An eval-mode copy of the network with every BatchNorm folded into
+        the convolution feeding it, for inference only.
+        """
+        net = copy.deepcopy(self).eval()
+        pairs = [(net, "conv", "bn"), (net, "policy_conv", "policy_bn"), (net, "value_conv", "value_bn")]
+        pairs += [(block, conv, bn) for block in net.blocks for conv, bn in (("conv1", "bn1"), ("conv2", "bn2"))]
+        for module, conv, bn in pairs:
+            setattr(module, conv, fuse_conv_bn_eval(getattr(module, conv), getattr(module, bn)))
+            setattr(module, bn, nn.Identity())
+        return net
+
+
+NETWORKS = {
+    "conv": GomokuNNet,
+    "resnet": GomokuResNet,
+}
+
+
+class QuantizedGomokuNNet(nn.Module):
+    """
+    Statically quantized GomokuNNet: the convolution trunk runs in int8 with
+    activation ranges observed on a calibration set, the linear layers are
+    quantized dynamically afterwards (see quantize_model).
+    """
+
+    def __init__(self, net):
+        from torch.ao.quantization import DeQuantStub, QuantStub
+
+        super(QuantizedGomokuNNet, self).__init__()
+        self.board_x, self.board_y = net.board_x, net.board_y
+        self.in_planes = net.in_planes
+        self.features = net.args.num_channels * (self.board_x - 4) * (self.board_y - 4)
+        self.quant = QuantStub()
+        self.trunk = nn.Sequential(
+            net.conv1, nn.ReLU(), net.conv2, nn.ReLU(), net.conv3, nn.ReLU(), net.conv4, nn.ReLU()
+        )
+        self.dequant = DeQuantStub()
+        self.fc1, self.fc2, self.fc3, self.fc4 = net.fc1, net.fc2, net.fc3, net.fc4
+
+    def forward(self, s):
+        s = self.quant(s.view(-1, self.in_planes, self.board_x, self.board_y))
+        s = self.dequant(self.trunk(s)).reshape(-1, self.features)
+        s = F.relu(self.fc2(F.relu(self.fc1(s))))
+        return F.log_softmax(self.fc3(s), dim=1), torch.tanh(self.fc4(s))
+
+
+def quantize_model(nnet, mode, calibration=None):
+    """
+    Returns an int8 CPU copy of the BatchNorm-folded network.
+
+    mode "dynamic" stores the linear layers (fc1 holds almost all weights) as
+    int8 and quantizes their inputs on the fly. Mode "static" additionally
+    runs the convolutions in int8, with activation scales observed on the
+    calibration inputs (encoded boards, see InputEncoder).
+    """
+    from torch.ao.quantization import convert, fuse_modules, get_default_qconfig, prepare, quantize_dynamic
+
+    net = nnet.fused().cpu()
+    if mode == "static":
+        if not isinstance(nnet, GomokuNNet):
+            raise ValueError("static quantization supports the conv architecture only")
+        if calibration is None or len(calibration) == 0:
+            raise ValueError("static quantization needs calibration inputs")
+        net = QuantizedGomokuNNet(net).eval()
+        fuse_modules(net.trunk, [["0", "1"], ["2", "3"], ["4", "5"], ["6", "7"]], inplace=True)
+        qconfig = get_default_qconfig(torch.backends.quantized.engine)
+        for module in (net.quant, net.trunk, net.dequant):
+            module.qconfig = qconfig
+        prepare(net, inplace=True)
+        with torch.no_grad():
+            for i in range(0, len(calibration), 64):
+                net(torch.from_numpy(calibration[i:i + 64]))
+        convert(net, inplace=True)
+    elif mode != "dynamic":
+        raise ValueError("not support quantization mode {}".format(mode))
+    return quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+
+
+def inference_network(nnet, args, calibration=None):
+    """
+    The network the inference backends run: BatchNorm folded, int8 if
+    args.quantize is set. Static quantization falls back to dynamic until
+    calibration inputs exist, e.g. during the first self-play iteration
+    (learn writes calibration.npy after it).
+    """
+    if args.quantize == "none":
+        return nnet.fused()
+    mode = args.quantize
+    if mode == "static" and (calibration is None or len(calibration) == 0):
+        log.warning("No calibration inputs yet, quantizing dynamically instead of statically")
+        mode = "dynamic"
+    return quantize_model(nnet, mode, calibration)
+
+
+def export_model(net, filepath, fmt):
+    """
+    Write an inference network (see inference_network) to filepath, either
+    as a traced TorchScript module ("torchscript") or as an ONNX graph
+    ("onnx"). Both take a float32 batch of input planes (see InputEncoder)
+    and return (log_pi, v), with a dynamic batch dimension.
+    """
+    net = net.cpu()
+    example = torch.zeros(2, net.in_planes, net.board_x, net.board_y)
+    with torch.no_grad():
+        if fmt == "torchscript":
+            torch.jit.trace(net, example).save(filepath)
+        elif fmt == "onnx":
+            torch.onnx.export(
+                net,
+                (example,),
+                filepath,
+                input_names=["board"],
+                output_names=["log_pi", "v"],
+                dynamic_axes={"board": {0: "batch"}, "log_pi": {0: "batch"}, "v": {0: "batch"}},
+                external_data=False,
+            )
+        else:
+            raise ValueError("not support export format {}".format(fmt))
+
+
+def module_device(net):
+    # int8 modules keep their weights in packed params, and always run on CPU
+    return next(net.parameters(), torch.zeros(0)).device
+
+
+class EagerBackend:
+    """
+    Runs the PyTorch module as is.
+
+    Input planes (see InputEncoder) are copied, as float32, into a
+    preallocated input tensor, pinned when the network is on the GPU, and
+    the results are written into preallocated output arrays. Both buffers
+    grow to the largest batch seen, so a call allocates nothing on the NumPy
+    side. The returned arrays are views into the output buffers and are only
+    valid until the next call.
+    """
+
+    def __init__(self, net, args):
+        self.nnet = net
+        self.args = args
+        self.device = module_device(net)
+        self.planes = args.input_planes
+        self.board_shape = (net.board_x, net.board_y)
+        self.capacity = 0
+
+    def _reserve(self, n):
+        capacity = max(n, 2 * self.capacity)
+        pin = self.device.type == "cuda"
+        self.inputs = torch.empty((capacity, self.planes) + self.board_shape, pin_memory=pin)
+        self.input_array = self.inputs.numpy()  # shares memory with inputs
+        self.pis = torch.empty(capacity, self.board_shape[0] * self.board_shape[1])
+        self.vs = torch.empty(capacity)
+        self.pi_array, self.v_array = self.pis.numpy(), self.vs.numpy()
+        self.capacity = capacity
+
+    def __call__(self, inputs):
+        n = len(inputs)
+        if n > self.capacity:
+            self._reserve(n)
+        self.input_array[:n] = inputs
+        with torch.inference_mode():
+            pi, v = self.nnet(self.inputs[:n].to(self.device, non_blocking=True))
+            torch.exp(pi.cpu(), out=self.pis[:n])
+            self.vs[:n] = v[:, 0]
+        return self.pi_array[:n], self.v_array[:n]
+
+
+class TorchScriptBackend(EagerBackend):
+    """Runs a frozen TorchScript trace of the network."""
+
+    def __init__(self, net, args):
+        super().__init__(net, args)
+        example = torch.zeros((2, self.planes) + self.board_shape, device=self.device)
+        with torch.no_grad():
+            self.nnet = torch.jit.freeze(torch.jit.trace(net, example))
+
+
+class OnnxRuntimeBackend:
+    """Runs the network exported to ONNX on ONNX Runtime (CPU)."""
+
+    def __init__(self, net, args):
+        import onnxruntime  # optional dependency, only needed for this backend
+
+        if args.quantize != "none":
+            raise ValueError("onnxruntime backend runs float32 models only, set quantize: none")
+        buffer = io.BytesIO()
+        export_model(net, buffer, "onnx")
+        self.session = onnxruntime.InferenceSession(
+            buffer.getvalue(), providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, inputs):
+        log_pi, v = self.session.run(None, {"board": np.asarray(inputs, dtype=np.float32)})
+        return np.exp(log_pi), v[:, 0]
+
+
+INFERENCE_BACKENDS = {
+    "eager": EagerBackend,
+    "torchscript": TorchScriptBackend,
+    "onnxruntime": OnnxRuntimeBackend,
+}
+
+
+def benchmark_networks(game, args, batch_sizes=(1, 8, 64), repeats=20):
+    """
+    Compares the architectures of NETWORKS at the current board size and
+    num_channels, with random weights folded for inference. For each one
+    returns the parameter count and, per batch size, the mean forward time
+    of a batch in ms and the throughput in boards per second.
+    """
+    n, _ = game.getBoardSize()
+    boards = np.random.default_rng(0).integers(-1, 2, (max(batch_sizes), n, n)).astype(np.int8)
+    boards = torch.from_numpy(InputEncoder(args.input_planes).encode(boards))
+    results = {}
+    for architecture, network in NETWORKS.items():
+        net = network(game, dotdict({**args, "architecture": architecture}))
+        params = sum(p.numel() for p in net.parameters())
+        net = net.fused()
+        results[architecture] = {"params": params, "batches": {}}
+        with torch.inference_mode():
+            for batch_size in batch_sizes:
+                net(boards[:batch_size])  # warm up
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    net(boards[:batch_size])
+                ms = (time.perf_counter() - start) / repeats * 1e3
+                results[architecture]["batches"][batch_size] = {"ms": ms, "boards_per_s": batch_size / ms * 1e3}
+    return results
+
+
+def quantization_report(nnet, boards, encoder, modes=None):
+    """
+    Compares int8 versions of nnet against the float32 network, on boards
+    encoded by encoder. modes defaults to dynamic and, for the conv
+    architecture (see quantize_model), static.
+
+    The first half of boards calibrates static quantization, the second half
+    is evaluated. For every mode (and "fp32") returns the serialized model
+    size in MB, the forward time of one board and of the whole evaluation
+    batch in ms, the fraction of boards where the most likely legal move
+    agrees with fp32, the mean total variation distance between the
+    policies, and the mean and max absolute value error.
+    """
+    inputs = encoder.encode(boards)
+    half = len(boards) // 2
+    calibration, evaluation = inputs[:half], torch.from_numpy(inputs[half:])
+    legal = torch.from_numpy(boards[half:].reshape(len(evaluation), -1) == 0)
+    networks = {"fp32": nnet.fused().cpu()}
+    if modes is None:
+        modes = ("dynamic", "static") if isinstance(nnet, GomokuNNet) else ("dynamic",)
+    for mode in modes:
+        networks[mode] = quantize_model(nnet, mode, calibration)
+
+    report = {}
+    for mode, net in networks.items():
+        buffer = io.BytesIO()
+        torch.save(net.state_dict(), buffer)
+        with torch.no_grad():
+            timings = []
+            for batch in (evaluation[:1], evaluation):
+                start = time.perf_counter()
+                for _ in range(10):
+                    log_pi, v = net(batch)
+                timings.append((time.perf_counter() - start) / 10 * 1e3)
+        pi = torch.exp(log_pi)
+        report[mode] = {"size_mb": buffer.getbuffer().nbytes / 2**20, "ms_single": timings[0], "ms_batch": timings[1]}
+        if mode == "fp32":
+            pi_ref, v_ref = pi, v
+            continue
+        report[mode].update(
+            policy_agreement=(
+                pi.masked_fill(~legal, -1).argmax(1) == pi_ref.masked_fill(~legal, -1).argmax(1)
+            ).float().mean().item(),
+            policy_tv=0.5 * (pi - pi_ref).abs().sum(1).mean().item(),
+            value_mae=(v - v_ref).abs().mean().item(),
+            value_max_err=(v - v_ref).abs().max().item(),
+        )
+    return report
+
 
 class AverageMeter(object):
     """From https://github.com/pytorch/examples/blob/master/imagenet/main.py"""
@@ -232,12 +1101,268 @@ class AverageMeter(object):
         self.avg = self.sum / self.count
 
 
+class TrainingExamples:
+    """
+    Training examples as contiguous arrays:
+        boards: int8 canonical boards, N x n x n
+        pis: float32 MCTS policies, N x n^2
+        vs: float32 game outcomes, N
+        lasts: int16 flat index of the move that led to each board, -1 for none
+    so a batch is a single fancy-index gather per array.
+
+    With symmetries (the src permutations of game.dihedral_perms) every
+    sampled example gets a random rotation/reflection, so each position is
+    stored once instead of in all 8 orientations.
+    """
+
+    def __init__(self, boards, pis, vs, lasts=None, symmetries=None):
+        self.boards = boards
+        self.pis = pis
+        self.vs = vs
+        self.lasts = np.full(len(vs), -1, dtype=np.int16) if lasts is None else lasts
+        self.symmetries = symmetries
+        if symmetries is not None:
+            self.moved_to = np.argsort(symmetries, axis=1)  # where each transform moves a cell
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Joins (boards, pis, vs, lasts) tuples in order."""
+        return cls(*(np.concatenate(arrays) for arrays in zip(*parts)))
+
+    def __len__(self):
+        return len(self.vs)
+
+    def epoch_size(self):
+        """
+        Examples seen per training epoch: every position once per symmetry,
+        as many as when all symmetric copies were stored.
+        """
+        return len(self) * (1 if self.symmetries is None else len(self.symmetries))
+
+    def _rows(self, batch_size):
+        return np.random.randint(len(self), size=batch_size)
+
+    def sample(self, batch_size):
+        """Returns the arrays (boards, pis, vs, lasts) of batch_size examples drawn with replacement."""
+        rows = self._rows(batch_size)
+        boards, pis, vs, lasts = self.boards[rows], self.pis[rows], self.vs[rows], self.lasts[rows]
+        if self.symmetries is not None:
+            k = np.random.randint(len(self.symmetries), size=batch_size)
+            perms = self.symmetries[k]
+            boards = np.take_along_axis(boards.reshape(batch_size, -1), perms, axis=1).reshape(boards.shape)
+            pis = np.take_along_axis(pis, perms, axis=1)
+            lasts = np.where(lasts >= 0, self.moved_to[k, np.maximum(lasts, 0)], -1).astype(np.int16)
+        return boards, pis, vs, lasts
+
+    def batches(self, batch_size, count, encoder, prefetch=0, pin_memory=False):
+        """
+        Yields count random batches as float32 tensors (inputs, pis, vs),
+        the boards encoded by encoder (an InputEncoder). With prefetch > 0 a
+        background thread assembles up to prefetch batches ahead of the
+        consumer, in pinned memory if pin_memory.
+        """
+
+        def make_batch():
+            boards, pis, vs, lasts = self.sample(batch_size)
+            inputs = encoder.encode(boards, lasts)
+            batch = (torch.from_numpy(inputs), torch.from_numpy(pis), torch.from_numpy(vs))
+            if pin_memory:
+                batch = tuple(t.pin_memory() for t in batch)
+            return batch
+
+        if prefetch <= 0:
+            for _ in range(count):
+                yield make_batch()
+            return
+
+        ready = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def produce():
+            for _ in range(count):
+                try:
+                    batch = make_batch()
+                except Exception as e:  # re-raised by the consumer
+                    batch = e
+                while not stop.is_set():
+                    try:
+                        ready.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set() or isinstance(batch, Exception):
+                    return
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            for _ in range(count):
+                batch = ready.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+
+class ReplayBuffer(TrainingExamples):
+    """
+    Training history kept on disk in folder, as memory-mapped boards.npy,
+    pis.npy, vs.npy and lasts.npy arrays with num_slots slots of slot_size rows. Each
+    iteration's examples go to the next slot, overwriting the oldest
+    iteration once all slots are used. Batches are gathered straight from
+    the mapped files, so nothing is copied or shuffled per iteration and only
+    the pages being read stay resident.
+
+    The slot lengths are saved in state.json after every add, so with resume
+    a restarted run picks up the history it had. Each slot also records
+    which add filled it (ids, 0 for empty), so restoring an older state()
+    can tell the slots that were overwritten since.
+    """
+
+    FIELDS = ("boards", "pis", "vs", "lasts")
+
+    def __init__(self, folder, num_slots, slot_size, board_shape, resume=False, symmetries=None):
+        self.folder = folder
+        layout = {
+            "num_slots": num_slots,
+            "slot_size": slot_size,
+            "board_shape": list(board_shape),
+            "fields": list(self.FIELDS),
+        }
+        state = self._read_state() if resume else None
+        if state is not None and all(state.get(k) == v for k, v in layout.items()):
+            mode = "r+"
+            log.info(f"Resuming the replay buffer in {folder} with {sum(state['lengths'])} examples")
+        else:
+            mode = "w+"
+            state = dict(layout, lengths=[0] * num_slots, ids=[0] * num_slots, next=0)
+            os.makedirs(folder, exist_ok=True)
+
+        rows = num_slots * slot_size
+        arrays = [
+            np.lib.format.open_memmap(
+                os.path.join(folder, name + ".npy"), mode=mode, dtype=dtype, shape=shape
+            )
+            for name, dtype, shape in (
+                ("boards", np.int8, (rows,) + tuple(board_shape)),
+                ("pis", np.float32, (rows, board_shape[0] * board_shape[1])),
+                ("vs", np.float32, (rows,)),
+                ("lasts", np.int16, (rows,)),
+            )
+        ]
+        super().__init__(*arrays, symmetries=symmetries)
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.resumed = mode == "r+"
+        self.ids = np.array(state.get("ids", [0] * num_slots), dtype=np.int64)  # add that filled each slot
+        self.restore(state)
+
+    def _read_state(self):
+        try:
+            with open(os.path.join(self.folder, "state.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def state(self):
+        """Where the buffer is and which slots are filled, for a training checkpoint"""
+        return {
+            "folder": self.folder,
+            "lengths": self.lengths.tolist(),
+            "ids": self.ids.tolist(),
+            "next": self.next,
+        }
+
+    def restore(self, state):
+        """
+        Go back to a state(), e.g. that of the last training checkpoint.
+        Slots rewritten since then hold rows of later iterations, or a mix
+        of both after a crash, so they are emptied.
+        """
+        self.lengths = np.array(state["lengths"], dtype=np.int64)
+        stale = self.ids != np.array(state.get("ids", self.ids), dtype=np.int64)
+        if stale.any():
+            log.warning(f"Dropping {self.lengths[stale].sum()} examples overwritten after the restored state")
+        self.lengths[stale] = 0
+        self.ids[stale] = 0
+        self.next = state["next"]  # slot of the next add
+        self._write_state()
+
+    def _write_state(self):
+        state = {
+            "num_slots": self.num_slots,
+            "slot_size": self.slot_size,
+            "board_shape": list(self.boards.shape[1:]),
+            "fields": list(self.FIELDS),
+            "lengths": self.lengths.tolist(),
+            "ids": self.ids.tolist(),
+            "next": self.next,
+        }
+        path = os.path.join(self.folder, "state.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    def add(self, examples):
+        """Store the newest slot_size of examples (TrainingExamples) as the latest iteration."""
+        slot = self.next
+        if self.lengths[slot]:
+            log.warning(f"Replacing the oldest {self.lengths[slot]} examples in the replay buffer")
+        # the slot is empty on disk while it is being rewritten
+        slot_id = self.ids.max() + 1
+        self.lengths[slot] = 0
+        self.ids[slot] = 0
+        self._write_state()
+
+        n = min(len(examples), self.slot_size)
+        start = slot * self.slot_size
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            array[start:start + n] = getattr(examples, name)[len(examples) - n:]
+            array.flush()
+        self.lengths[slot] = n
+        self.ids[slot] = slot_id
+        self.next = (slot + 1) % self.num_slots
+        self._write_state()
+
+    def __len__(self):
+        return int(self.lengths.sum())
+
+    def __getstate__(self):
+        # pickled without the arrays, the copy maps the files read-only (e.g. in a training worker)
+        state = self.__dict__.copy()
+        for name in self.FIELDS:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in self.FIELDS:
+            setattr(self, name, np.load(os.path.join(self.folder, name + ".npy"), mmap_mode="r"))
+
+    def _rows(self, batch_size):
+        ids = np.sort(np.random.randint(len(self), size=batch_size))  # sorted for locality
+        ends = np.cumsum(self.lengths)
+        slots = np.searchsorted(ends, ids, side="right")
+        return slots * self.slot_size + ids - (ends - self.lengths)[slots]
+
+
 class NNetWrapper:
     def __init__(self, game, args):
-        self.nnet = GomokuNNet(game, args)
+        self.game = game
+        self.nnet = NETWORKS[args.architecture](game, args)
+        if args.quantize == "static" and not isinstance(self.nnet, GomokuNNet):
+            raise ValueError("static quantization supports the conv architecture only, set quantize: dynamic")
         self.board_x, self.board_y = game.getBoardSize()
         self.action_size = game.getActionSize()
         self.args = args
+        self.model_version = new_model_version()  # renewed whenever the weights change
+        self.backend = None  # args.backend, built for backend_version
+        self.backend_version = None
+        self.encoder = InputEncoder(args.input_planes)
+        self.calibration_boards = None  # self-play boards for static quantization
 
         if args.cuda:
             self.nnet.cuda()
@@ -270,43 +1395,150 @@ class NNetWrapper:
 
     def train(self, examples):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: TrainingExamples
+
+        With args.precision "bf16" the forward pass runs under bfloat16
+        autocast, and with args.channels_last the convolutions run on NHWC
+        tensors (the weights go back to the default layout afterwards). The
+        losses are summed on the device and only read back every
+        args.log_interval steps, for the progress bar and wandb.
+
+        With args.ddp_workers > 1 training runs data-parallel in that many
+        worker processes, see _train_distributed.
+        """
+        self.model_version = new_model_version()
+        if self.args.ddp_workers > 1:
+            self._train_distributed(examples)
+        else:
+            self._train_epochs(examples)
+
+    def _train_distributed(self, examples):
+        """
+        Trains in args.ddp_workers spawned processes joined by a gloo process
+        group (CPU only). Every step each worker draws batch_size / ddp_workers
+        examples of its own, and DistributedDataParallel averages the
+        gradients, so a step still covers batch_size examples and the 1cycle
+        schedule of get_learning_rate advances exactly as in one process. The
+        weights, Adam state and step are handed to the workers and taken back
+        from the first one.
+        """
+        if self.args.cuda:
+            raise ValueError("distributed training runs on CPU only")
+        world_size = self.args.ddp_workers
+        if self.args.batch_size % world_size:
+            log.warning(f"batch_size {self.args.batch_size} is not a multiple of ddp_workers {world_size}")
+        threads = max(1, torch.get_num_threads() // world_size)
+        seed = np.random.randint(2 ** 31 - world_size)
+        training_state = self._training_state()
+
+        ctx = mp.get_context("spawn")
+        results = ctx.Queue()
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        workers = [
+            ctx.Process(
+                target=_ddp_train_worker,
+                args=(rank, world_size, port, self.game, self.args, examples, training_state, seed, threads, results),
+            )
+            for rank in range(world_size)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            while True:
+                try:
+                    training_state, metrics = results.get(timeout=1)
+                    break
+                except queue.Empty:
+                    if any(worker.exitcode not in (None, 0) for worker in workers):
+                        raise RuntimeError("a distributed training worker failed")
+        finally:
+            for worker in workers:
+                worker.join(timeout=None if worker.exitcode == 0 else 10)
+                if worker.is_alive():
+                    worker.terminate()
+
+        self._load_training_state(training_state)
+        if getattr(self.args, 'wandb', False):
+            for record in metrics:
+                wandb.log(record)
+
+    def _training_state(self):
+        """The weights, Adam state and 1cycle step, serialized to send to another process"""
+        buffer = io.BytesIO()
+        torch.save(
+            {
+                "state_dict": self.state_dict(),
+                "optimizer": self.optimizer.state_dict(),
+                "current_step": self.current_step,
+            },
+            buffer,
+        )
+        return buffer.getvalue()
+
+    def _load_training_state(self, training_state):
+        state = torch.load(io.BytesIO(training_state), map_location="cpu", weights_only=True)
+        self.nnet.load_state_dict(state["state_dict"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.current_step = state["current_step"]
+
+    def _train_epochs(self, examples, rank=0, world_size=1):
+        """
+        The training loop, run by this process alone or by each of
+        world_size distributed workers. Returns the metrics of every
+        log_interval, with the losses averaged over all workers.
         """
+        device = "cuda" if self.args.cuda else "cpu"
+        memory_format = torch.channels_last if self.args.channels_last else torch.contiguous_format
+        model = self.nnet.to(memory_format=memory_format)
+        if world_size > 1:
+            from torch.nn.parallel import DistributedDataParallel
+
+            model = DistributedDataParallel(self.nnet)
+        batch_size = self.args.batch_size // world_size
+        metrics = []
         for epoch in range(self.args.epochs):
-            print("EPOCH ::: " + str(epoch + 1))
+            if rank == 0:
+                print("EPOCH ::: " + str(epoch + 1))
             self.nnet.train()
             pi_losses = AverageMeter()
             v_losses = AverageMeter()
+            # since the last read back: sum of the losses over the examples, and their number
+            pi_sum = torch.zeros((), device=device)
+            v_sum = torch.zeros((), device=device)
+            unlogged = 0
+
+            batch_count = int(examples.epoch_size() / self.args.batch_size)
+            batches = examples.batches(
+                batch_size, batch_count, self.encoder, self.args.prefetch, pin_memory=self.args.cuda
+            )
 
-            batch_count = int(len(examples) / self.args.batch_size)
-
-            t = tqdm(range(batch_count), desc="Training Net")
-            for _ in t:
+            t = tqdm(batches, total=batch_count, desc="Training Net", disable=rank > 0)
+            for step, (boards, target_pis, target_vs) in enumerate(t, 1):
                 # Update learning rate
                 lr = self.get_learning_rate()
                 for param_group in self.optimizer.param_groups:
                     param_group['lr'] = lr
                 self.current_step += 1
 
-                sample_ids = np.random.randint(len(examples), size=self.args.batch_size)
-                boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
-                boards = torch.FloatTensor(np.array(boards).astype(np.float32))
-                target_pis = torch.FloatTensor(np.array(pis))
-                target_vs = torch.FloatTensor(np.array(vs).astype(np.float32))
-
                 if self.args.cuda:
-                    boards, target_pis, target_vs = boards.cuda(), target_pis.cuda(), target_vs.cuda()
+                    boards = boards.cuda(non_blocking=True)
+                    target_pis = target_pis.cuda(non_blocking=True)
+                    target_vs = target_vs.cuda(non_blocking=True)
+                boards = boards.contiguous(memory_format=memory_format)
 
                 # compute output
-                out_pi, out_v = self.nnet(boards)
-                l_pi = self.loss_pi(target_pis, out_pi)
-                l_v = self.loss_v(target_vs, out_v)
+                with torch.autocast(device, dtype=torch.bfloat16, enabled=self.args.precision == "bf16"):
+                    out_pi, out_v = model(boards)
+                l_pi = self.loss_pi(target_pis, out_pi.float())
+                l_v = self.loss_v(target_vs, out_v.float())
                 total_loss = l_pi + l_v
 
                 # record loss
-                pi_losses.update(l_pi.item(), boards.size(0))
-                v_losses.update(l_v.item(), boards.size(0))
-                t.set_postfix(Loss_pi=pi_losses, Loss_v=v_losses, lr=f"{lr:.1e}")
+                pi_sum += l_pi.detach() * boards.size(0)
+                v_sum += l_v.detach() * boards.size(0)
+                unlogged += boards.size(0)
 
                 # compute gradient and do SGD step
                 self.optimizer.zero_grad()
@@ -318,33 +1550,63 @@ class NNetWrapper:
                 
                 self.optimizer.step()
 
-                if getattr(self.args, 'wandb', False):
-                    wandb.log({
+                if step % self.args.log_interval == 0 or step == batch_count:
+                    sums = torch.stack([pi_sum, v_sum, torch.tensor(float(unlogged), device=device)])
+                    if world_size > 1:
+                        torch.distributed.all_reduce(sums)
+                    pi_total, v_total, count = sums.tolist()
+                    pi_losses.update(pi_total / count, count)
+                    v_losses.update(v_total / count, count)
+                    t.set_postfix(Loss_pi=pi_losses, Loss_v=v_losses, lr=f"{lr:.1e}")
+                    metrics.append({
                         'learning_rate': lr,
-                        'policy_loss': l_pi.item(),
-                        'value_loss': l_v.item(),
-                        'total_loss': total_loss.item(),
+                        'policy_loss': pi_losses.val,
+                        'value_loss': v_losses.val,
+                        'total_loss': pi_losses.val + v_losses.val,
                         'current_step': self.current_step,
                     })
-
-    def predict(self, board):
+                    if world_size == 1 and getattr(self.args, 'wandb', False):
+                        wandb.log(metrics[-1])
+                    pi_sum.zero_()
+                    v_sum.zero_()
+                    unlogged = 0
+        self.nnet.to(memory_format=torch.contiguous_format)
+        return metrics
+
+    def predict(self, board, last=-1):
         """
         board: np array with board
+        last: flat index of the move that led to board, -1 if unknown
         """
-        # timing
-        # start = time.time()
+        pis, vs = self.predict_batch(board[np.newaxis], np.array([last]))
+        return pis[0], vs[:1]
 
-        # preparing input
-        board = torch.FloatTensor(board.astype(np.float32))
-        if self.args.cuda:
-            board = board.cuda()
-        board = board.view(1, self.board_x, self.board_y)
-        self.nnet.eval()
-        with torch.no_grad():
-            pi, v = self.nnet(board)
+    def predict_batch(self, boards, lasts=None):
+        """
+        boards: np array of boards, batch_size x board_x x board_y
+        lasts: flat index of the move that led to each board, -1 if unknown
 
-        # print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
-        return torch.exp(pi).data.cpu().numpy()[0], v.data.cpu().numpy()[0]
+        Evaluates all boards in a single forward pass, see predict_inputs.
+        """
+        return self.predict_inputs(self.encoder.encode(boards.reshape(-1, self.board_x, self.board_y), lasts))
+
+    def predict_inputs(self, inputs):
+        """
+        inputs: input planes (see InputEncoder), batch_size x planes x board_x x board_y
+
+        Evaluates all inputs in a single forward pass of the args.backend
+        inference backend, which is rebuilt whenever the weights change.
+        The returned arrays may be views into the backend's output buffers,
+        valid until the next call.
+        """
+        if self.backend_version != self.model_version:
+            calibration = None
+            if self.calibration_boards is not None:
+                calibration = self.encoder.encode(self.calibration_boards)
+            net = inference_network(self.nnet, self.args, calibration)
+            self.backend = INFERENCE_BACKENDS[self.args.backend](net, self.args)
+            self.backend_version = self.model_version
+        return self.backend(inputs)
 
     def loss_pi(self, targets, outputs):
         return -torch.sum(targets * outputs) / targets.size()[0]
@@ -352,7 +1614,23 @@ class NNetWrapper:
     def loss_v(self, targets, outputs):
         return torch.sum((targets - outputs.view(-1)) ** 2) / targets.size()[0]
 
-    def save_checkpoint(self, folder="checkpoint", filename="checkpoint.pth.tar"):
+    def state_dict(self):
+        """An in-memory snapshot of the weights, on CPU and independent of later training"""
+        return {k: v.detach().cpu().clone() for k, v in self.nnet.state_dict().items()}
+
+    def load_state_dict(self, state_dict):
+        self.nnet.load_state_dict(state_dict)
+        self.model_version = new_model_version()
+
+    def save_checkpoint(
+        self, folder="checkpoint", filename="checkpoint.pth.tar", background=False, training_state=None
+    ):
+        """
+        With background the weights are snapshotted now and written by
+        checkpoint_writer while the caller carries on. With training_state
+        (a dict of the caller's own state) the checkpoint also holds the
+        Adam state and 1cycle step, so training can resume where it was.
+        """
         filepath = os.path.join(folder, filename)
         if not os.path.exists(folder):
             print(
@@ -363,21 +1641,194 @@ class NNetWrapper:
             os.mkdir(folder)
         else:
             print("Checkpoint Directory exists! ")
-        torch.save(
-            {
-                "state_dict": self.nnet.state_dict(),
-            },
-            filepath,
-        )
+        checkpoint = {"state_dict": self.state_dict()}
+        if training_state is not None:
+            checkpoint.update(
+                training_state,
+                optimizer=copy.deepcopy(self.optimizer.state_dict()),
+                current_step=self.current_step,
+            )
+        if background:
+            checkpoint_writer.submit(checkpoint, filepath)
+        else:
+            atomic_save(checkpoint, filepath)
 
     def load_checkpoint(self, folder="checkpoint", filename="checkpoint.pth.tar"):
+        checkpoint_writer.wait()  # a background save of this file may be in flight
         folder = folder.rstrip('/')
         filepath = os.path.join(folder, filename)
         if not os.path.exists(filepath):
             raise ValueError("No model in path {}".format(filepath))
         map_location = None if self.args.cuda else "cpu"
         checkpoint = torch.load(filepath, map_location=map_location, weights_only=True)
-        self.nnet.load_state_dict(checkpoint["state_dict"])
+        self.load_state_dict(checkpoint["state_dict"])
+        if "optimizer" in checkpoint:
+            self.optimizer.load_state_dict(checkpoint["optimizer"])
+            self.current_step = checkpoint["current_step"]
+        calibration = os.path.join(folder, "calibration.npy")
+        if os.path.exists(calibration):
+            self.calibration_boards = np.load(calibration)
+        return checkpoint
+
+
+class InferenceServer:
+    """
+    Owns a network and evaluates boards for many concurrent MCTS instances.
+
+    Clients put the input planes of their leaves on a shared request queue.
+    A background thread takes the first waiting request, then keeps collecting
+    requests until max_batch boards are gathered or max_wait seconds have
+    passed, runs them through one predict_inputs call and sends every client its
+    rows back. Clients may be threads of this process, or worker processes
+    when ctx (a multiprocessing context) is given.
+
+    If a forward pass raises, the exception is sent to every client of the
+    batch, and to every later request until stop(), so that clients raise
+    it instead of waiting for an answer that never comes.
+
+    Batch sizes and queue latencies (from a client's put to the start of
+    the forward pass that serves it) are kept as histograms, see stats().
+    """
+
+    # upper edges of the queue latency histogram, in seconds
+    LATENCY_EDGES = np.array([1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 1e-1, np.inf])
+
+    def __init__(self, nnet, max_batch=64, max_wait=0.002, ctx=None):
+        self.nnet = nnet
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.ctx = ctx
+        self.requests = self._queue()
+        self.responses = []  # response queue of each client
+        self.batch_sizes = np.zeros(max_batch + 1, dtype=np.int64)  # batch_sizes[k]: #batches of k boards
+        self.latencies = np.zeros(len(self.LATENCY_EDGES), dtype=np.int64)
+        self.thread = None
+
+    def _queue(self):
+        return queue.Queue() if self.ctx is None else self.ctx.Queue()
+
+    def client(self):
+        """Register and return a new client. Call before start()."""
+        self.responses.append(self._queue())
+        return InferenceClient(
+            len(self.responses) - 1, self.requests, self.responses[-1], self.nnet.encoder, self.nnet.model_version
+        )
+
+    def start(self):
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def _serve(self):
+        running = True
+        while running:
+            request = self.requests.get()
+            if request is None:
+                break
+            batch = [request]
+            size = len(request[2])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    running = False
+                    break
+                batch.append(request)
+                size += len(request[2])
+
+            start = time.monotonic()
+            try:
+                pis, vs = self.nnet.predict_inputs(np.concatenate([inputs for _, _, inputs in batch]))
+            except Exception as e:
+                log.exception("Inference server failed")
+                for client_id, _, _ in batch:
+                    self.responses[client_id].put(e)
+                if running:
+                    self._fail(e)
+                return
+
+            self.batch_sizes[min(size, self.max_batch)] += 1
+            waits = [start - sent for _, sent, _ in batch]
+            np.add.at(self.latencies, np.searchsorted(self.LATENCY_EDGES, waits), 1)
+
+            i = 0
+            for client_id, _, inputs in batch:
+                j = i + len(inputs)
+                # copies, the next batch reuses the backend's output buffers
+                self.responses[client_id].put((pis[i:j].copy(), vs[i:j].copy()))
+                i = j
+
+    def _fail(self, error):
+        """Answers every request with error until stop()"""
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            self.responses[request[0]].put(error)
+
+    def stats(self):
+        """
+        Returns:
+            batch_sizes: batch_sizes[k] is the number of forward passes over
+                         k boards (larger batches are counted at max_batch)
+            latency_edges: upper edges of the latency bins, in seconds
+            latencies: number of requests that waited in each latency bin
+        """
+        return {
+            "batch_sizes": self.batch_sizes.copy(),
+            "latency_edges": self.LATENCY_EDGES.copy(),
+            "latencies": self.latencies.copy(),
+        }
+
+    def log_stats(self):
+        batches = self.batch_sizes.sum()
+        if batches == 0:
+            return
+        mean_batch = (self.batch_sizes * np.arange(len(self.batch_sizes))).sum() / batches
+        cum = np.cumsum(self.latencies) / self.latencies.sum()
+        p50, p99 = (self.LATENCY_EDGES[np.searchsorted(cum, q)] for q in (0.5, 0.99))
+        log.info(
+            f"Inference server: {batches} batches, mean batch size {mean_batch:.1f}, "
+            f"queue latency p50 <= {p50 * 1e3:g} ms, p99 <= {p99 * 1e3:g} ms"
+        )
+
+
+class InferenceClient:
+    """
+    Stand-in for NNetWrapper.predict / predict_batch / predict_inputs that
+    forwards the input planes to an InferenceServer and blocks until the
+    result comes back.
+    """
+
+    def __init__(self, client_id, requests, responses, encoder, model_version=None):
+        self.client_id = client_id
+        self.requests = requests
+        self.responses = responses
+        self.encoder = encoder
+        self.model_version = model_version  # of the server's network, for evaluation_cache
+
+    def predict(self, board, last=-1):
+        pis, vs = self.predict_batch(board[np.newaxis], np.array([last]))
+        return pis[0], vs[:1]
+
+    def predict_batch(self, boards, lasts=None):
+        return self.predict_inputs(self.encoder.encode(np.asarray(boards), lasts))
+
+    def predict_inputs(self, inputs):
+        self.requests.put((self.client_id, time.monotonic(), np.asarray(inputs)))
+        result = self.responses.get()
+        if isinstance(result, Exception):
+            raise result  # the server's forward pass failed
+        return result
 
 
 class SelfPlay:
@@ -388,12 +1839,86 @@ class SelfPlay:
     def __init__(self, game, nnet, args):
         self.game = game
         self.nnet = nnet
-        self.pnet = self.nnet.__class__(self.game, args)  # the competitor network
+        self.pnet = None  # the competitor network, created by learn()
         self.args = args
         self.mcts = MCTS(self.game, self.nnet, self.args)
-        self.trainExamplesHistory = []  # history of examples from args.numItersForTrainExamplesHistory latest iterations
+        self.replay = None  # examples of the args.numItersForTrainExamplesHistory latest iterations, created by learn()
+        self.start_iteration = 1
+        self.replay_state = None  # of the training checkpoint learn() resumes from
 
-    def executeEpisode(self):
+    def playEpisode(self, seed):
+        """
+        Plays one self-play episode on a fresh search tree with its own
+        random generator seeded from seed, so an episode is reproducible
+        wherever it runs, also on a thread next to training (args.pipeline).
+        The network evaluates in eval mode and draws no random numbers.
+
+        Returns:
+            boards: int8 array of canonical boards, num_examples x n x n
+            pis: float32 array of MCTS policies, num_examples x action_size
+            vs: float32 array of game outcomes, num_examples
+            lasts: int16 array of the move that led to each board, -1 for none
+        """
+        rng = np.random.default_rng(seed)
+        self.mcts = MCTS(self.game, self.nnet, self.args, rng)  # reset search tree
+        boards, pis, vs, lasts = zip(*self.executeEpisode(rng))
+        return (
+            np.array(boards, dtype=np.int8),
+            np.array(pis, dtype=np.float32),
+            np.array(vs, dtype=np.float32),
+            np.array(lasts, dtype=np.int16),
+        )
+
+    def runSelfPlay(self, iteration):
+        """
+        Plays the numEps episodes of an iteration with the current network.
+        With args.num_workers > 1 the episodes are spread over that many
+        worker processes. Each worker loads the current network from a
+        checkpoint, or, with args.inference_server, sends its leaves to an
+        InferenceServer thread in this process that batches them across all
+        workers on a single copy of the network.
+        Episode seeds derive from args.seed, the iteration and the episode
+        index, so the examples do not depend on the number of workers.
+
+        Returns:
+            an iterator over the (boards, pis, vs, lasts) arrays of each
+            episode, in episode order
+        """
+        first_seed = self.args.seed + (iteration - 1) * self.args.numEps
+        seeds = range(first_seed, first_seed + self.args.numEps)
+
+        if self.args.num_workers <= 1:
+            for seed in tqdm(seeds, desc="Self Play"):
+                yield self.playEpisode(seed)
+            return
+
+        ctx = mp.get_context("spawn")
+        server = None
+        if self.args.inference_server:
+            server = InferenceServer(
+                self.nnet, self.args.server_max_batch, self.args.server_max_wait, ctx=ctx
+            )
+            clients = [server.client() for _ in range(self.args.num_workers)]
+            initargs = (self.game, self.args, clients, ctx.Value("i", 0))
+            server.start()
+        else:
+            filename = "selfplay.pth.tar"
+            self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=filename)
+            initargs = (self.game, self.args, self.args.checkpoint, filename)
+
+        try:
+            with ctx.Pool(
+                self.args.num_workers, initializer=_init_selfplay_worker, initargs=initargs
+            ) as pool:
+                yield from tqdm(
+                    pool.imap(_selfplay_episode, seeds), total=len(seeds), desc="Self Play"
+                )
+        finally:
+            if server is not None:
+                server.stop()
+                server.log_stats()
+
+    def executeEpisode(self, rng=np.random):
         """
         This function executes one episode of self-play, starting with player 1.
         As the game is played, each turn is added as a training example to
@@ -402,116 +1927,334 @@ class SelfPlay:
         in trainExamples.
 
         It uses a temp=1 if episodeStep < tempThreshold, and thereafter
-        uses temp=0.
+        uses temp=0. Moves are drawn from rng, a np.random.Generator or the
+        global np.random.
 
         Returns:
-            trainExamples: a list of examples of the form (canonicalBoard, pi, v)
+            trainExamples: a list of examples of the form (canonicalBoard, pi, v, last)
+                           with last the action that led to canonicalBoard
         """
         trainExamples = []
         board = self.game.getInitBoard()
         self.curPlayer = 1
         episodeStep = 0
+        last = -1
 
         while True:
             episodeStep += 1
             canonicalBoard = self.game.getCanonicalForm(board, self.curPlayer)
             temp = int(episodeStep < self.args.tempThreshold)
 
-            pi = self.mcts.getActionProb(canonicalBoard, temp=temp)
-            sym = self.game.getSymmetries(canonicalBoard, pi)
-            for b, p in sym:
-                trainExamples.append([b, self.curPlayer, p, None])
+            pi = self.mcts.getActionProb(canonicalBoard, temp=temp, last=last)
+            # stored once, the replay buffer applies a random symmetry when sampling
+            trainExamples.append([canonicalBoard, self.curPlayer, pi, last])
 
-            action = np.random.choice(len(pi), p=pi)
+            action = rng.choice(len(pi), p=pi)
+            last = action
             board, self.curPlayer = self.game.getNextState(
                 board, self.curPlayer, action
             )
 
-            r = self.game.getGameEnded(board, self.curPlayer)
+            r = self.game.getGameEnded(board, self.curPlayer, action)
 
             if r is not None:
                 # r * (1 if self.curPlayer == x[1] else -1) means 1 for winner, -1 for loser, 0 for draw.
                 return [
-                    (x[0], x[2], r * (1 if self.curPlayer == x[1] else -1))
+                    (x[0], x[2], r * (1 if self.curPlayer == x[1] else -1), x[3])
                     for x in trainExamples
                 ]
 
+    def load_checkpoint(self, folder, filename):
+        """
+        Loads the network. A training checkpoint (training.pth.tar, see
+        learn) also restores the optimizer, the 1cycle step, the iteration
+        to continue after and the replay buffer contents.
+        """
+        checkpoint = self.nnet.load_checkpoint(folder, filename)
+        if "iteration" in checkpoint:
+            log.info(f"Resuming training after iteration {checkpoint['iteration']}")
+            self.start_iteration = checkpoint["iteration"] + 1
+            self.replay_state = checkpoint["replay"]
+
+    def playIteration(self, iteration):
+        """The self-play examples of an iteration, see runSelfPlay"""
+        return TrainingExamples.concatenate(list(self.runSelfPlay(iteration)))
+
+    def runArena(self):
+        """
+        Pits self.nnet against self.pnet in up to arenaCompare games, the new
+        network moving first in the even ones. Like runSelfPlay, the games
+        are spread over args.num_workers processes, which load both networks
+        from checkpoints or, with args.inference_server, query one
+        InferenceServer per network. Play stops early as soon as sprt()
+        decides whether the new network beats updateThreshold.
+
+        Returns:
+            pwins, nwins, draws
+        """
+        results = {1: 0, -1: 0, 0: 0}  # from the new network's side
+        for result in self._arenaGames(range(self.args.arenaCompare)):
+            results[result] += 1
+            decision = sprt(
+                results[1], results[-1], self.args.updateThreshold, self.args.arenaSprtDelta, self.args.arenaSprtError
+            )
+            if decision is not None:
+                log.info(
+                    f"Arena stopped after {sum(results.values())} games, "
+                    f"SPRT {'accepts' if decision else 'rejects'} the new model"
+                )
+                break
+        return results[-1], results[1], results[0]
+
+    def _arenaGames(self, games):
+        """Yields the result of each arena game for the new network, in order."""
+        if self.args.num_workers <= 1:
+            pplayer = mcts_player(MCTS(self.game, self.pnet, self.args))
+            nplayer = mcts_player(MCTS(self.game, self.nnet, self.args))
+            for index in tqdm(games, desc="Arena"):
+                yield play_arena_game(self.game, pplayer, nplayer, index)
+            return
+
+        ctx = mp.get_context("spawn")
+        servers = []
+        if self.args.inference_server:
+            servers = [
+                InferenceServer(net, self.args.server_max_batch, self.args.server_max_wait, ctx=ctx)
+                for net in (self.pnet, self.nnet)
+            ]
+            clients = [[server.client() for _ in range(self.args.num_workers)] for server in servers]
+            initargs = (self.game, self.args, *clients, ctx.Value("i", 0))
+            for server in servers:
+                server.start()
+        else:
+            self.pnet.save_checkpoint(folder=self.args.checkpoint, filename="arena_prev.pth.tar")
+            self.nnet.save_checkpoint(folder=self.args.checkpoint, filename="arena_new.pth.tar")
+            initargs = (self.game, self.args, self.args.checkpoint, "arena_prev.pth.tar", "arena_new.pth.tar")
+
+        try:
+            with ctx.Pool(
+                self.args.num_workers, initializer=_init_arena_worker, initargs=initargs
+            ) as pool:
+                yield from tqdm(pool.imap(_arena_game, games), total=len(games), desc="Arena")
+        finally:
+            for server in servers:
+                server.stop()
+                server.log_stats()
+
     def learn(self):
         """
         Performs numIters iterations with numEps episodes of self-play in each
         iteration. After every iteration, it retrains neural network with
-        examples in trainExamples (which has a maximum length of maxlenofQueue).
+        the examples of the latest iterations in the replay buffer (at most
+        maxlenOfQueue per iteration).
         It then pits the new neural network against the old one and accepts it
-        only if it wins >= updateThreshold fraction of games.
+        only if it wins >= updateThreshold fraction of games. With
+        args.pipeline the next iteration's self-play, by the model accepted
+        so far, overlaps this training and gating.
         """
 
-        for i in range(1, self.args.numIters + 1):
-            # bookkeeping
-            log.info(f"Starting Iter #{i} ...")
-            # examples of the iteration
-            iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
+        if self.pnet is None:
+            self.pnet = self.nnet.__class__(self.game, self.args)
+        if self.replay is None:
+            self.replay = ReplayBuffer(
+                os.path.join(self.args.checkpoint, "replay")
+                if self.replay_state is None
+                else self.replay_state["folder"],
+                self.args.numItersForTrainExamplesHistory,
+                self.args.maxlenOfQueue,
+                self.game.getBoardSize(),
+                resume=self.args.load_model,
+                symmetries=self.game.getSymmetryPerms()[0],
+            )
+            if self.replay_state is not None:
+                if self.replay.resumed:
+                    # drops whatever a crashed iteration added after the checkpoint
+                    self.replay.restore(self.replay_state)
+                else:
+                    log.warning("The replay buffer of the training checkpoint is gone, starting empty")
+
+        # with args.pipeline, self-play of the next iteration runs on a thread
+        # with its own copy of the network while this one trains and gates
+        if self.args.pipeline:
+            selfplayer = SelfPlay(self.game, self.nnet.__class__(self.game, self.args), self.args)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="selfplay") as executor:
+            next_examples = None
+            for i in range(self.start_iteration, self.args.numIters + 1):
+                # bookkeeping
+                log.info(f"Starting Iter #{i} ...")
+                # examples of the iteration, kept in the replay buffer for the next
+                # numItersForTrainExamplesHistory iterations
+                if next_examples is None:
+                    self.replay.add(self.playIteration(i))
+                else:
+                    self.replay.add(next_examples.result())
+
+                # a sample of recent positions, to calibrate static quantization
+                # here and in the worker processes (which load calibration.npy)
+                boards, _, _, _ = self.replay.sample(min(len(self.replay), self.args.calibration_size))
+                np.save(os.path.join(self.args.checkpoint, "calibration.npy"), boards)
+                self.nnet.calibration_boards = self.pnet.calibration_boards = boards
+
+                # training new network, keeping an in-memory copy of the old one
+                self.pnet.load_state_dict(self.nnet.state_dict())
+                if self.args.pipeline and i < self.args.numIters:
+                    # the latest accepted model plays the next iteration
+                    selfplayer.nnet.calibration_boards = boards
+                    selfplayer.nnet.load_state_dict(self.pnet.state_dict())
+                    next_examples = executor.submit(selfplayer.playIteration, i + 1)
+
+                self.nnet.train(self.replay)
+
+                log.info("PITTING AGAINST PREVIOUS VERSION")
+                pwins, nwins, draws = self.runArena()
+
+                log.info("NEW/PREV WINS : %d / %d ; DRAWS : %d" % (nwins, pwins, draws))
+                evaluation_cache.log_stats()
+                if (
+                    pwins + nwins == 0
+                    or float(nwins) / (pwins + nwins) < self.args.updateThreshold
+                ):
+                    log.info("REJECTING NEW MODEL")
+                    self.nnet.load_state_dict(self.pnet.state_dict())
+                else:
+                    log.info("ACCEPTING NEW MODEL")
+                    self.nnet.save_checkpoint(
+                        folder=self.args.checkpoint, filename="best.pth.tar", background=True
+                    )
+                # everything needed to continue after this iteration, see load_checkpoint
+                self.nnet.save_checkpoint(
+                    folder=self.args.checkpoint,
+                    filename="training.pth.tar",
+                    background=True,
+                    training_state={"iteration": i, "replay": self.replay.state()},
+                )
+        checkpoint_writer.wait()
 
-            for _ in tqdm(range(self.args.numEps), desc="Self Play"):
-                self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
-                iterationTrainExamples += self.executeEpisode()
 
-            # save the iteration examples to the history
-            self.trainExamplesHistory.append(iterationTrainExamples)
+def _ddp_train_worker(rank, world_size, port, g, args, examples, training_state, seed, threads, results):
+    """
+    Worker rank of NNetWrapper._train_distributed: trains a copy of the
+    network on its own batches, and the first worker sends the resulting
+    training state and metrics back on results.
+    """
+    import torch.distributed as dist
 
-            if (
-                len(self.trainExamplesHistory)
-                > self.args.numItersForTrainExamplesHistory
-            ):
-                log.warning(
-                    f"Removing the oldest entry in trainExamples. len(trainExamplesHistory) = {len(self.trainExamplesHistory)}"
-                )
-                self.trainExamplesHistory.pop(0)
+    torch.set_num_threads(threads)
+    dist.init_process_group(
+        "gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size
+    )
+    try:
+        np.random.seed(seed + rank)
+        torch.manual_seed(seed + rank)
+        nnet = NNetWrapper(g, args)
+        nnet._load_training_state(training_state)
+        metrics = nnet._train_epochs(examples, rank, world_size)
+        if rank == 0:
+            results.put((nnet._training_state(), metrics))
+    finally:
+        dist.destroy_process_group()
 
-            # shuffle examples before training
-            trainExamples = []
-            for e in self.trainExamplesHistory:
-                trainExamples.extend(e)
-            shuffle(trainExamples)
 
-            # training new network, keeping a copy of the old one
-            self.nnet.save_checkpoint(
-                folder=self.args.checkpoint, filename="temp.pth.tar"
-            )
-            self.pnet.load_checkpoint(
-                folder=self.args.checkpoint, filename="temp.pth.tar"
-            )
-            pmcts = MCTS(self.game, self.pnet, self.args)
+_selfplay = None  # the SelfPlay of a worker process, set by _init_selfplay_worker
 
-            self.nnet.train(trainExamples)
-            nmcts = MCTS(self.game, self.nnet, self.args)
 
-            log.info("PITTING AGAINST PREVIOUS VERSION")
-            arena = game.Arena(
-                lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
-                lambda x: np.argmax(nmcts.getActionProb(x, temp=0)),
-                self.game,
-            )
-            pwins, nwins, draws = arena.playGames(self.args.arenaCompare)
-
-            log.info("NEW/PREV WINS : %d / %d ; DRAWS : %d" % (nwins, pwins, draws))
-            if (
-                pwins + nwins == 0
-                or float(nwins) / (pwins + nwins) < self.args.updateThreshold
-            ):
-                log.info("REJECTING NEW MODEL")
-                self.nnet.load_checkpoint(
-                    folder=self.args.checkpoint, filename="temp.pth.tar"
-                )
-            else:
-                log.info("ACCEPTING NEW MODEL")
-                self.nnet.save_checkpoint(
-                    folder=self.args.checkpoint, filename="best.pth.tar"
-                )
+def _init_selfplay_worker(g, args, *source):
+    """
+    source is either (folder, filename) of the checkpoint to load, or
+    (clients, counter): the InferenceClients of the pool and a shared
+    counter handing each worker its own client.
+    """
+    global _selfplay
+    torch.set_num_threads(1)  # one core per worker
+    if args.inference_server:
+        clients, counter = source
+        with counter.get_lock():
+            nnet = clients[counter.value]
+            counter.value += 1
+    else:
+        nnet = NNetWrapper(g, args)
+        nnet.load_checkpoint(*source)
+    _selfplay = SelfPlay(g, nnet, args)
+
+
+def _selfplay_episode(seed):
+    return _selfplay.playEpisode(seed)
+
+
+def mcts_player(mcts):
+    return lambda x, last=-1: np.argmax(mcts.getActionProb(x, temp=0, last=last))
+
+
+def play_arena_game(g, pplayer, nplayer, index):
+    """
+    Plays arena game index, where the new network's player moves first if
+    index is even. Returns 1 if the new network wins, -1 if it loses, 0 for a draw.
+    """
+    if index % 2 == 0:
+        return game.Arena(nplayer, pplayer, g).playGame()
+    return -game.Arena(pplayer, nplayer, g).playGame()
+
+
+def sprt(wins, losses, threshold, delta, error):
+    """
+    Sequential probability ratio test on the probability p that the new
+    network wins a decisive game, H0: p = threshold - delta against
+    H1: p = threshold + delta, with false accept and reject rates of error.
+    Returns True (accept) or False (reject) once the log likelihood ratio of
+    the results so far leaves its bounds, otherwise None. Draws carry no
+    information and delta <= 0 never decides.
+    """
+    if delta <= 0:
+        return None
+    p0, p1 = max(threshold - delta, 1e-6), min(threshold + delta, 1 - 1e-6)
+    llr = wins * math.log(p1 / p0) + losses * math.log((1 - p1) / (1 - p0))
+    bound = math.log((1 - error) / error)
+    if llr >= bound:
+        return True
+    if llr <= -bound:
+        return False
+    return None
+
+
+_arena = None  # (game, previous player, new player) of a worker process, set by _init_arena_worker
+
+
+def _init_arena_worker(g, args, *source):
+    """
+    source is either (folder, previous filename, new filename) of the two
+    checkpoints to load, or (previous clients, new clients, counter): the
+    InferenceClients of both servers and a shared counter handing each
+    worker its own pair.
+    """
+    global _arena
+    torch.set_num_threads(1)  # one core per worker
+    if args.inference_server:
+        pclients, nclients, counter = source
+        with counter.get_lock():
+            pnet, nnet = pclients[counter.value], nclients[counter.value]
+            counter.value += 1
+    else:
+        folder, pfile, nfile = source
+        pnet, nnet = NNetWrapper(g, args), NNetWrapper(g, args)
+        pnet.load_checkpoint(folder, pfile)
+        nnet.load_checkpoint(folder, nfile)
+    _arena = (g, mcts_player(MCTS(g, pnet, args)), mcts_player(MCTS(g, nnet, args)))
+
+
+def _arena_game(index):
+    return play_arena_game(*_arena, index)
 
 
 class dotdict(dict):
+    # attributes live in the dict, so dotdict({**args, ...}) copies every setting
+    __setattr__ = dict.__setitem__
+
     def __getattr__(self, name):
-        return self[name]
+        # AttributeError (not KeyError) keeps getattr() defaults and pickling working
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
 
 
 def load_config(config_path):
@@ -531,23 +2274,49 @@ def load_config(config_path):
     args.updateThreshold = config['training']['update_threshold']
     args.arenaCompare = config['training']['arena_compare']
     args.tempThreshold = config['training']['temp_threshold']
+    args.num_workers = config['training']['num_workers']
+    args.prefetch = config['training']['prefetch']
+    args.pipeline = config['training']['pipeline']
+    args.precision = config['training']['precision']
+    args.channels_last = config['training']['channels_last']
+    args.log_interval = config['training']['log_interval']
+    args.ddp_workers = config['training']['ddp_workers']
+    args.arenaSprtDelta = config['training']['arena_sprt_delta']
+    args.arenaSprtError = config['training']['arena_sprt_error']
     
     # Network params
+    args.architecture = config['network']['architecture']
     args.num_channels = config['network']['num_channels']
+    args.num_blocks = config['network']['num_blocks']
     args.dropout = config['network']['dropout']
     args.min_lr = config['network']['learning_rate']['min']
     args.max_lr = config['network']['learning_rate']['max']
     args.grad_clip = config['network']['grad_clip']
+    args.backend = config['network']['backend']
+    args.quantize = config['network']['quantize']
+    args.calibration_size = config['network']['calibration_size']
+    args.input_planes = config['network']['input_planes']
     
     # MCTS params
     args.numMCTSSims = config['mcts']['num_sims']
     args.cpuct = config['mcts']['cpuct']
+    args.mctsBatchSize = config['mcts']['batch_size']
+    args.virtualLoss = config['mcts']['virtual_loss']
+    args.symmetricTable = config['mcts']['symmetric_table']
+    args.tableSize = config['mcts']['table_size']
     
+    # Inference params
+    args.inference_server = config['inference']['server']
+    args.server_max_batch = config['inference']['max_batch']
+    args.server_max_wait = config['inference']['max_wait_ms'] / 1000.0
+    args.evalCacheSize = config['inference']['cache_size']
+
     # Game params
     args.board_size = config['game']['board_size']
     
     # System params
     args.cuda = config['system']['cuda'] and torch.cuda.is_available()
+    args.seed = config['system']['seed']
     args.checkpoint = config['system']['checkpoint_dir']
     args.load_model = config['system']['load_model']
     args.load_folder_file = tuple(config['system']['load_folder_file'])
@@ -567,23 +2336,47 @@ def print_config(args):
     print(f"  Training History Length: {args.numItersForTrainExamplesHistory}")
     print(f"  Update Threshold: {args.updateThreshold}")
     print(f"  Arena Compare Games: {args.arenaCompare}")
+    print(f"  Arena SPRT: delta {args.arenaSprtDelta}, error {args.arenaSprtError}")
     print(f"  Temperature Threshold: {args.tempThreshold}")
+    print(f"  Self-Play Workers: {args.num_workers}")
+    print(f"  Prefetched Batches: {args.prefetch}")
+    print(f"  Pipelined Self-Play: {args.pipeline}")
+    print(f"  Training Precision: {args.precision}, channels last: {args.channels_last}")
+    print(f"  Log Interval: {args.log_interval}")
+    print(f"  Data-Parallel Training Workers: {args.ddp_workers}")
     
     print("\nNetwork Parameters:")
+    print(f"  Architecture: {args.architecture}")
     print(f"  Number of Channels: {args.num_channels}")
+    print(f"  Residual Blocks: {args.num_blocks}")
     print(f"  Dropout: {args.dropout}")
     print(f"  Learning Rate Range: {args.min_lr} - {args.max_lr}")
     print(f"  Gradient Clip: {args.grad_clip}")
+    print(f"  Inference Backend: {args.backend}")
+    print(f"  Quantization: {args.quantize}")
+    print(f"  Calibration Size: {args.calibration_size}")
+    print(f"  Input Planes: {args.input_planes}")
     
     print("\nMCTS Parameters:")
     print(f"  MCTS Simulations: {args.numMCTSSims}")
     print(f"  CPUCT: {args.cpuct}")
+    print(f"  Leaf Batch Size: {args.mctsBatchSize}")
+    print(f"  Virtual Loss: {args.virtualLoss}")
+    print(f"  Symmetric Transposition Table: {args.symmetricTable}")
+    print(f"  Transposition Table Size: {args.tableSize}")
     
+    print("\nInference Parameters:")
+    print(f"  Inference Server: {args.inference_server}")
+    print(f"  Max Batch: {args.server_max_batch}")
+    print(f"  Max Wait: {args.server_max_wait * 1000:g} ms")
+    print(f"  Evaluation Cache Size: {args.evalCacheSize}")
+
     print("\nGame Parameters:")
     print(f"  Board Size: {args.board_size}")
     
     print("\nSystem Parameters:")
     print(f"  CUDA Enabled: {args.cuda}")
+    print(f"  Seed: {args.seed}")
     print(f"  Checkpoint Directory: {args.checkpoint}")
     print(f"  Load Model: {args.load_model}")
     print(f"  Load Path: {args.load_folder_file}")
@@ -614,6 +2407,24 @@ def main():
         choices=["human", "random", "greedy", "alphazero"],
     )
     parser.add_argument("--ckpt_file", type=str, default="best.pth.tar")
+    parser.add_argument(
+        "--export",
+        type=str,
+        default=None,
+        choices=["torchscript", "onnx"],
+        help="Export checkpoint/ckpt_file with BatchNorm folded",
+    )
+    parser.add_argument("--export_file", type=str, default=None, help="Defaults to the checkpoint name with .pt/.onnx")
+    parser.add_argument(
+        "--quant_report",
+        action="store_true",
+        help="Compare int8 checkpoint/ckpt_file against fp32 on its calibration boards",
+    )
+    parser.add_argument(
+        "--benchmark_net",
+        action="store_true",
+        help="Compare params, latency and throughput of the network architectures",
+    )
     parser.add_argument("--wandb", action="store_true", help="Use wandb to record the training process")
     parser.add_argument("--wandb_project", type=str, default="alphazero-gomoku", help="wandb project name")
     parser.add_argument("--wandb_entity", type=str, default=None, help="wandb entity name")
@@ -644,7 +2455,9 @@ def main():
                     "num_episodes": args.numEps,
                     "num_mcts_sims": args.numMCTSSims,
                     "batch_size": args.batch_size,
+                    "architecture": args.architecture,
                     "num_channels": args.num_channels,
+                    "num_blocks": args.num_blocks,
                     "learning_rate_min": args.min_lr,
                     "learning_rate_max": args.max_lr,
                     "grad_clip": args.grad_clip,
@@ -655,20 +2468,57 @@ def main():
             )
 
         nnet = NNetWrapper(g, args)
+        log.info("Loading the SelfCoach...")
+        s = SelfPlay(g, nnet, args)
         if args.load_model:
             log.info(
                 'Loading checkpoint "%s/%s"...',
                 args.load_folder_file[0],
                 args.load_folder_file[1],
             )
-            nnet.load_checkpoint(args.load_folder_file[0], args.load_folder_file[1])
-
-        log.info("Loading the SelfCoach...")
-        s = SelfPlay(g, nnet, args)
+            s.load_checkpoint(args.load_folder_file[0], args.load_folder_file[1])
 
         log.info("Starting the learning process 🎉")
         s.learn()
 
+    if args.export:
+        if args.export == "onnx" and args.quantize != "none":
+            raise ValueError("onnx export supports float32 models only, set quantize: none or export torchscript")
+        nnet = NNetWrapper(g, args)
+        nnet.load_checkpoint(args.checkpoint, args.ckpt_file)
+        export_file = args.export_file or os.path.join(
+            args.checkpoint,
+            args.ckpt_file.split(".")[0] + (".pt" if args.export == "torchscript" else ".onnx"),
+        )
+        calibration = None
+        if nnet.calibration_boards is not None:
+            calibration = nnet.encoder.encode(nnet.calibration_boards)
+        export_model(
+            inference_network(nnet.nnet, args, calibration), export_file, args.export
+        )
+        log.info("Exported %s model to %s", args.export, export_file)
+
+    if args.quant_report:
+        nnet = NNetWrapper(g, args)
+        nnet.load_checkpoint(args.checkpoint, args.ckpt_file)
+        if nnet.calibration_boards is None:
+            raise ValueError("No calibration.npy in {}, it is written by --train".format(args.checkpoint))
+        report = quantization_report(nnet.nnet, nnet.calibration_boards, nnet.encoder)
+        for mode, r in report.items():
+            line = f"{mode:>8}: {r['size_mb']:8.2f} MB, {r['ms_single']:7.2f} ms/board, {r['ms_batch']:8.2f} ms/batch"
+            if mode != "fp32":
+                line += (
+                    f", policy agreement {r['policy_agreement']:.1%}, policy TV {r['policy_tv']:.2e}"
+                    f", value MAE {r['value_mae']:.2e} (max {r['value_max_err']:.2e})"
+                )
+            print(line)
+
+    if args.benchmark_net:
+        for architecture, r in benchmark_networks(g, args).items():
+            print(f"{architecture:>8}: {r['params'] / 1e6:8.2f}M params")
+            for batch_size, b in r["batches"].items():
+                print(f"  batch {batch_size:4d}: {b['ms']:8.2f} ms/batch, {b['boards_per_s']:9.0f} boards/s")
+
     if args.play:
         def getPlayFunc(name):
             if name == "human":
@@ -680,8 +2530,7 @@ def main():
             elif name == "alphazero":
                 nnet = NNetWrapper(g, args)
                 nnet.load_checkpoint(args.checkpoint, args.ckpt_file)
-                mcts = MCTS(g, nnet, dotdict({"numMCTSSims": 800, "cpuct": 1.0}))
-                return lambda x: np.argmax(mcts.getActionProb(x, temp=0))
+                return mcts_player(MCTS(g, nnet, dotdict({**args, "numMCTSSims": 800, "cpuct": 1.0})))
             else:
                 raise ValueError("not support player name {}".format(name))
 
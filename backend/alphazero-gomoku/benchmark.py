@@ -0,0 +1,285 @@
+"""
+Self-play throughput benchmarks, for comparing performance between commits.
+
+Everything runs from fixed seeds: a randomly initialized network (no
+checkpoint needed), fixed opening positions and fixed episode seeds, so
+two runs on the same machine measure the same work. For every board size
+it reports
+    game: moves/s of GomokuGame.getNextState + getGameEnded on random games
+    predict: NNetWrapper.predict_batch latency and evaluations/s per batch size
+    mcts: simulations (nodes)/s, tree nodes/s and network evaluations/s of one
+          getActionProb per position, per mctsBatchSize
+    selfplay: seconds per episode and moves/s of SelfPlay.playEpisode
+and writes them, with the settings and the commit measured, as JSON:
+
+    python benchmark.py --board_sizes 9 15 --batch_sizes 1 8 32 --output bench.json
+
+The network, backend, MCTS and system settings come from --config. The
+evaluation cache is off so that every simulation is measured.
+"""
+
+import itertools
+import json
+import logging
+import platform
+import subprocess
+import time
+
+import numpy as np
+import torch
+
+import game
+from alphazero import MCTS, NNetWrapper, SelfPlay, evaluation_cache, load_config
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+class CountingNet:
+    """Forwards predict_batch / predict_inputs to an NNetWrapper, counting calls and boards"""
+
+    def __init__(self, nnet):
+        self.nnet = nnet
+        self.model_version = nnet.model_version
+        self.calls = 0
+        self.evals = 0
+
+    def predict_batch(self, boards, lasts=None):
+        self.calls += 1
+        self.evals += len(boards)
+        return self.nnet.predict_batch(boards, lasts)
+
+    def predict_inputs(self, inputs):
+        self.calls += 1
+        self.evals += len(inputs)
+        return self.nnet.predict_inputs(inputs)
+
+
+def random_network(g, args, seed):
+    torch.manual_seed(seed)
+    nnet = NNetWrapper(g, args)
+    nnet.nnet.eval()
+    return nnet
+
+
+def opening_positions(g, count, stones, seed):
+    """
+    count undecided canonical positions (with their last move), each reached
+    by stones random moves from the empty board.
+    """
+    rng = np.random.default_rng(seed)
+    positions = []
+    while len(positions) < count:
+        board, player, action = g.getInitBoard(), 1, -1
+        for _ in range(stones):
+            action = int(rng.choice(np.flatnonzero(g.getValidMoves(board, player))))
+            board, player = g.getNextState(board, player, action)
+        if g.getGameEnded(board, player) is None:
+            positions.append((g.getCanonicalForm(board, player), action))
+    return positions
+
+
+def benchmark_game(g, moves, seed):
+    """Plays random games until moves moves are made"""
+    rng = np.random.default_rng(seed)
+    n = g.getActionSize()
+    orders = [rng.permutation(n) for _ in range(moves // n + 1)]
+    played = games = 0
+    start = time.perf_counter()
+    for order in itertools.cycle(orders):
+        board, player = g.getInitBoard(), 1
+        games += 1
+        for action in order:
+            board, player = g.getNextState(board, player, action)
+            played += 1
+            if g.getGameEnded(board, player, action) is not None or played == moves:
+                break
+        if played == moves:
+            break
+    seconds = time.perf_counter() - start
+    return {"moves": played, "games": games, "seconds": seconds, "moves_per_s": played / seconds}
+
+
+def benchmark_predict(nnet, positions, batch_sizes, repeats):
+    """Forward passes of batch_size boards taken from positions"""
+    boards = np.stack([board for board, _ in positions])
+    lasts = np.array([last for _, last in positions])
+    results = {}
+    for batch_size in batch_sizes:
+        rows = np.arange(batch_size) % len(boards)
+        nnet.predict_batch(boards[rows], lasts[rows])  # warm up, builds the backend
+        start = time.perf_counter()
+        for _ in range(repeats):
+            nnet.predict_batch(boards[rows], lasts[rows])
+        seconds = time.perf_counter() - start
+        results[batch_size] = {
+            "ms_per_batch": seconds / repeats * 1e3,
+            "evals_per_s": batch_size * repeats / seconds,
+        }
+    return results
+
+
+def benchmark_mcts(g, nnet, args, positions, batch_sizes, seed):
+    """One getActionProb of args.numMCTSSims simulations on a fresh tree per position"""
+    results = {}
+    for batch_size in batch_sizes:
+        args.mctsBatchSize = batch_size
+        counter = CountingNet(nnet)
+        np.random.seed(seed)
+        sims = nodes = 0
+        start = time.perf_counter()
+        for board, last in positions:
+            mcts = MCTS(g, counter, args)
+            mcts.getActionProb(board, temp=1, last=last)
+            sims += args.numMCTSSims
+            nodes += mcts.tree.size
+        seconds = time.perf_counter() - start
+        results[batch_size] = {
+            "positions": len(positions),
+            "simulations": sims,
+            "seconds": seconds,
+            "nodes_per_s": sims / seconds,
+            "tree_nodes_per_s": nodes / seconds,
+            "evals_per_s": counter.evals / seconds,
+            "mean_eval_batch": counter.evals / max(counter.calls, 1),
+        }
+    return results
+
+
+def benchmark_selfplay(g, nnet, args, episodes, seed):
+    """Plays episodes self-play games with seeds seed, seed + 1, ..."""
+    counter = CountingNet(nnet)
+    selfplay = SelfPlay(g, counter, args)
+    times, moves = [], 0
+    for episode in range(episodes):
+        start = time.perf_counter()
+        boards, _, _, _ = selfplay.playEpisode(seed + episode)
+        times.append(time.perf_counter() - start)
+        moves += len(boards)
+    seconds = sum(times)
+    return {
+        "episodes": episodes,
+        "moves": moves,
+        "episode_s": seconds / episodes,
+        "episode_s_min": min(times),
+        "episode_s_max": max(times),
+        "moves_per_s": moves / seconds,
+        "evals_per_s": counter.evals / seconds,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, board_sizes, batch_sizes, positions, opening_stones, repeats, game_moves, episodes):
+    args.evalCacheSize = 0
+    evaluation_cache.resize(0)
+    results = []
+    for n in board_sizes:
+        log.info(f"Benchmarking {n}x{n}")
+        g = game.GomokuGame(n)
+        nnet = random_network(g, args, args.seed)
+        openings = opening_positions(g, positions, opening_stones, args.seed)
+        mcts_batch = args.mctsBatchSize
+        results.append({
+            "board_size": n,
+            "game": benchmark_game(g, game_moves, args.seed),
+            "predict": benchmark_predict(nnet, openings, batch_sizes, repeats),
+            "mcts": benchmark_mcts(g, nnet, args, openings, batch_sizes, args.seed),
+        })
+        args.mctsBatchSize = mcts_batch
+        if episodes:
+            results[-1]["selfplay"] = benchmark_selfplay(g, nnet, args, episodes, args.seed)
+    return results
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--config", type=str, default="config.yaml", help="Path to config file")
+    parser.add_argument("--board_sizes", type=int, nargs="+", default=[9, 15])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8, 32], help="predict batches and mctsBatchSize")
+    parser.add_argument("--sims", type=int, default=200, help="MCTS simulations per move")
+    parser.add_argument("--positions", type=int, default=8, help="fixed positions searched per batch size")
+    parser.add_argument("--opening_stones", type=int, default=8, help="random stones of each position")
+    parser.add_argument("--repeats", type=int, default=20, help="forward passes per predict batch size")
+    parser.add_argument("--game_moves", type=int, default=20000, help="moves of the game engine benchmark")
+    parser.add_argument("--episodes", type=int, default=2, help="self-play episodes per board size (0: skip)")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads (0: torch default)")
+    parser.add_argument("--output", type=str, default="benchmark.json")
+    options = parser.parse_args()
+
+    args = load_config(options.config)
+    args.numMCTSSims = options.sims
+    if options.threads:
+        torch.set_num_threads(options.threads)
+
+    results = run(
+        args,
+        options.board_sizes,
+        options.batch_sizes,
+        options.positions,
+        options.opening_stones,
+        options.repeats,
+        options.game_moves,
+        options.episodes,
+    )
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+        },
+        "settings": {
+            "seed": args.seed,
+            "cuda": args.cuda,
+            "architecture": args.architecture,
+            "num_channels": args.num_channels,
+            "num_blocks": args.num_blocks,
+            "input_planes": args.input_planes,
+            "backend": args.backend,
+            "quantize": args.quantize,
+            "num_sims": args.numMCTSSims,
+            "cpuct": args.cpuct,
+            "virtual_loss": args.virtualLoss,
+            "symmetric_table": args.symmetricTable,
+            "positions": options.positions,
+            "opening_stones": options.opening_stones,
+            "repeats": options.repeats,
+            "episodes": options.episodes,
+        },
+        "results": results,
+    }
+    with open(options.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for r in results:
+        n = r["board_size"]
+        log.info(f"{n}x{n} game: {r['game']['moves_per_s']:.0f} moves/s")
+        for batch_size, p in r["predict"].items():
+            log.info(f"{n}x{n} predict batch {batch_size}: {p['ms_per_batch']:.2f} ms, {p['evals_per_s']:.0f} evals/s")
+        for batch_size, m in r["mcts"].items():
+            log.info(
+                f"{n}x{n} mcts batch {batch_size}: {m['nodes_per_s']:.0f} nodes/s, "
+                f"{m['evals_per_s']:.0f} evals/s"
+            )
+        if "selfplay" in r:
+            s = r["selfplay"]
+            log.info(f"{n}x{n} self-play: {s['episode_s']:.2f} s/episode, {s['moves_per_s']:.1f} moves/s")
+    log.info(f"Wrote {options.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import numpy as np
+import functools
 import logging
 from tqdm import tqdm
 import pygame
@@ -7,77 +8,229 @@ import sys
 log = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def zobrist_keys(n):
+    """
+    Random 64-bit Zobrist keys of an n x n board, one per color and cell:
+    row 0 is for a 1 stone, row 1 for a -1 stone. Returned both as a uint64
+    array (for hashing whole boards) and as lists of Python ints (for cheap
+    incremental updates).
+    """
+    rng = np.random.default_rng(n)
+    keys = rng.integers(np.iinfo(np.uint64).max, size=(2, n * n), dtype=np.uint64, endpoint=True)
+    return keys, keys.tolist()
+
+
+@functools.lru_cache(maxsize=None)
+def dihedral_perms(n):
+    """
+    The 8 rotations/reflections of an n x n board as permutations of the
+    flat cell index, identity first.
+
+    Returns:
+        src: src[k][j] is the cell that transform k moves onto cell j, so
+             the transformed board is board.ravel()[src[k]]
+        dst: dst[k][a] is the cell that transform k moves cell a onto
+        compose: compose[j][k] is the transform equal to k followed by j
+        inverse: inverse[k] is the transform that undoes k
+    """
+    idx = np.arange(n * n).reshape(n, n)
+    src = np.array(
+        [(np.fliplr(np.rot90(idx, i)) if flip else np.rot90(idx, i)).ravel()
+         for i in range(4) for flip in (False, True)]
+    )
+    dst = np.argsort(src, axis=1)
+    index = {tuple(p): k for k, p in enumerate(dst)}
+    compose = [[index[tuple(dst[j][dst[k]])] for k in range(8)] for j in range(8)]
+    inverse = [index[tuple(src[k])] for k in range(8)]
+    return src, dst, compose, inverse
+
+
+def zobrist_hash(board):
+    """Zobrist hash of an n x n board, computed from scratch"""
+    keys, _ = zobrist_keys(len(board))
+    cells = np.ravel(board)
+    return int(np.bitwise_xor.reduce(keys[0][cells == 1])) ^ int(
+        np.bitwise_xor.reduce(keys[1][cells == -1])
+    )
+
+
+def has_five(mask):
+    """
+    Check if an n x n boolean mask has five consecutive True cells in a
+    row, column or diagonal. Each direction is tested with shifted slices
+    of the whole board, so there is no Python loop over cells.
+    """
+    n = len(mask)
+    if n < 5:
+        return False
+    m = n - 4
+    rows = mask[:, :m].copy()
+    cols = mask[:m, :].copy()
+    diag = mask[:m, :m].copy()
+    anti = mask[:m, 4:].copy()
+    for k in range(1, 5):
+        rows &= mask[:, k:m + k]
+        cols &= mask[k:m + k, :]
+        diag &= mask[k:m + k, k:m + k]
+        anti &= mask[k:m + k, 4 - k:n - k]
+    return bool(rows.any() or cols.any() or diag.any() or anti.any())
+
+
+def has_five_at(cells, n, action):
+    """
+    Check if the stone on cell action of a flat board is part of five in a
+    row, looking only along the four lines through it.
+    """
+    color = cells[action]
+    x, y = divmod(int(action), n)
+    for dx, dy in ((1, 0), (0, 1), (1, 1), (1, -1)):
+        count = 1
+        for sign in (1, -1):
+            tx, ty = x + dx * sign, y + dy * sign
+            while 0 <= tx < n and 0 <= ty < n and cells[tx * n + ty] == color:
+                count += 1
+                tx += dx * sign
+                ty += dy * sign
+        if count >= 5:
+            return True
+    return False
+
+
 class Board:
     """
     Gomoku board class
     Board data:
     1=white, -1=black, 0=empty
+
+    The cells are stored in a flat int8 array indexed by action
+    (x * n + y), and pieces is an n x n view of the same memory. Moves are
+    applied in place and taken back with undo_action, so a search can walk
+    a single board up and down the tree.
+
+    The Zobrist hash of the board and of its negation (the board as seen
+    by the other player) are updated with every move, see key(). With
+    symmetric=True the hashes of all 8 rotations/reflections are kept as
+    well, see orbit_key().
+
+    The stones of each color (colors[0] for 1, colors[1] for -1, as 0/1
+    int8 rows) and the last move played (last, -1 if unknown) are kept up
+    to date as well, for building network input planes.
     """
 
-    def __init__(self, n=15):
+    def __init__(self, n=15, pieces=None, symmetric=False, last=-1):
         self.n = n
-        # Create an empty board
-        self.pieces = [[0] * n for _ in range(n)]
+        # Create an empty board, or a copy of pieces
+        if pieces is None:
+            self.cells = np.zeros(n * n, dtype=np.int8)
+        else:
+            self.cells = np.array(pieces, dtype=np.int8).reshape(n * n)
+        self.pieces = self.cells.reshape(n, n)
+        self.stones = int(np.count_nonzero(self.cells))
+        self.colors = np.stack([self.cells == 1, self.cells == -1]).astype(np.int8)
+        self.moves = [last]  # the action that led to pieces, then those played on it
+        _, self.zobrist = zobrist_keys(n)
+        self.hash = zobrist_hash(self.pieces)
+        self.hash_neg = zobrist_hash(-self.pieces)
+        self.symmetric = symmetric
+        if symmetric:
+            keys, _ = zobrist_keys(n)
+            src, dst, _, _ = dihedral_perms(n)
+            # sym_keys[c][:, a]: the key of a stone of color row c on cell a, per transform
+            self.sym_keys = keys[:, dst]
+            cells = self.cells[src]
+            self.sym_hashes = np.array([
+                np.bitwise_xor.reduce(np.where(cells == c, keys[0], 0) ^ np.where(cells == -c, keys[1], 0), axis=1)
+                for c in (1, -1)
+            ])  # row 0 for the board, row 1 for its negation
 
     def __getitem__(self, index):
         return self.pieces[index]
 
     def get_legal_moves(self, color):
         """Return all legal move positions"""
-        moves = []
-        for y in range(self.n):
-            for x in range(self.n):
-                if self[x][y] == 0:
-                    moves.append((x, y))
-        return moves
+        return [(int(a) // self.n, int(a) % self.n) for a in np.flatnonzero(self.cells == 0)]
 
     def has_legal_moves(self):
         """Check if there are any legal moves"""
-        for y in range(self.n):
-            for x in range(self.n):
-                if self[x][y] == 0:
-                    return True
-        return False
+        return self.stones < self.n * self.n
 
     def execute_move(self, move, color):
         """Place a piece on the specified position"""
         x, y = move
-        self[x][y] = color
+        self.execute_action(x * self.n + y, color)
+
+    def execute_action(self, action, color):
+        """Place a piece on the cell with the given action index"""
+        self.cells[action] = color
+        self.colors[0 if color == 1 else 1, action] = 1
+        self.stones += 1
+        self.moves.append(action)
+        self._toggle_hash(action, color)
+
+    def undo_action(self, action):
+        """Remove the piece placed by execute_action, the last one not undone yet"""
+        self._toggle_hash(action, self.cells[action])
+        self.cells[action] = 0
+        self.colors[:, action] = 0
+        self.stones -= 1
+        self.moves.pop()
+
+    @property
+    def last(self):
+        """The action that led to the current position, -1 if unknown"""
+        return self.moves[-1]
+
+    def _toggle_hash(self, action, color):
+        own, other = (0, 1) if color == 1 else (1, 0)
+        self.hash ^= self.zobrist[own][action]
+        self.hash_neg ^= self.zobrist[other][action]
+        if self.symmetric:
+            self.sym_hashes[0] ^= self.sym_keys[own][:, action]
+            self.sym_hashes[1] ^= self.sym_keys[other][:, action]
+
+    def key(self, player):
+        """
+        Zobrist hash of the canonical form of the board for player, i.e.
+        stringRepresentation(getCanonicalForm(pieces, player))
+        """
+        return self.hash if player == 1 else self.hash_neg
+
+    def orbit_key(self, player):
+        """
+        Key shared by the canonical form for player and all its
+        rotations/reflections: the smallest of their Zobrist hashes.
+
+        Returns:
+            key: the orbit key (key(player) if the board is not symmetric)
+            sym: a transform k of dihedral_perms that maps the canonical
+                 form onto the board whose hash is key
+        """
+        if not self.symmetric:
+            return self.key(player), 0
+        hashes = self.sym_hashes[0 if player == 1 else 1]
+        k = int(np.argmin(hashes))
+        return int(hashes[k]), k
 
     def is_win(self, color):
         """Check if there is a win"""
-        # Check all directions
-        directions = [(1, 0), (0, 1), (1, 1), (1, -1)]
-
-        for y in range(self.n):
-            for x in range(self.n):
-                if self[x][y] == color:
-                    # Check each direction
-                    for dx, dy in directions:
-                        count = 1
-                        # Check forward
-                        tx, ty = x + dx, y + dy
-                        while (
-                            0 <= tx < self.n
-                            and 0 <= ty < self.n
-                            and self[tx][ty] == color
-                        ):
-                            count += 1
-                            tx += dx
-                            ty += dy
-                        # Check backward
-                        tx, ty = x - dx, y - dy
-                        while (
-                            0 <= tx < self.n
-                            and 0 <= ty < self.n
-                            and self[tx][ty] == color
-                        ):
-                            count += 1
-                            tx -= dx
-                            ty -= dy
-                        if count >= 5:
-                            return True
-        return False
+        return has_five(self.pieces == color)
+
+    def is_win_at(self, action):
+        """Check if the piece on action completes five in a row"""
+        return has_five_at(self.cells, self.n, action)
+
+    def get_game_ended(self, player, action):
+        """
+        getGameEnded for the position right after action was played, from
+        the point of view of player. Only the lines through action can have
+        changed, and the stone count tells whether the board is full.
+        """
+        if self.is_win_at(action):
+            return 1 if self.cells[action] == player else -1
+        if not self.has_legal_moves():
+            return 0
+        return None
 
 
 class GomokuGame:
@@ -88,7 +241,7 @@ class GomokuGame:
 
     def getInitBoard(self):
         b = Board(self.n)
-        return np.array(b.pieces)
+        return b.pieces
 
     def getBoardSize(self):
         return (self.n, self.n)
@@ -96,33 +249,36 @@ class GomokuGame:
     def getActionSize(self):
         return self.n * self.n
 
+    def makeBoard(self, board, symmetric=False, last=-1):
+        """Return a Board holding a copy of board, reached by action last, for in-place play"""
+        return Board(self.n, board, symmetric, last)
+
     def getNextState(self, board, player, action):
-        b = Board(self.n)
-        b.pieces = np.copy(board)
-        # Fix: Ensure consistent coordinate transformation
-        move = (action // self.n, action % self.n)  # This gives (x, y)
-        b.execute_move(move, player)
-        return (b.pieces, -player)
+        # action indexes the flattened board, i.e. (x, y) = (action // n, action % n)
+        next_board = np.copy(board, order="C")
+        next_board.reshape(-1)[action] = player
+        return (next_board, -player)
 
     def getValidMoves(self, board, player):
-        b = Board(self.n)
-        b.pieces = np.copy(board)
-        valids = [0] * self.getActionSize()
-        legalMoves = b.get_legal_moves(player)
-        for x, y in legalMoves:
-            # Fix: Ensure consistent coordinate transformation
-            valids[self.n * x + y] = 1
-        return np.array(valids)
-
-    def getGameEnded(self, board, player):
-        b = Board(self.n)
-        b.pieces = np.copy(board)
+        return (np.ravel(board) == 0).astype(np.int8)
 
-        if b.is_win(player):
+    def getGameEnded(self, board, player, action=None):
+        """
+        action: the move that led to board from an undecided position, if
+                known. Then only the four lines through it are checked.
+        """
+        if action is not None:
+            if has_five_at(np.ravel(board), self.n, action):
+                return 1 if np.ravel(board)[action] == player else -1
+            if np.all(board):
+                return 0
+            return None
+
+        if has_five(board == player):
             return 1
-        if b.is_win(-player):
+        if has_five(board == -player):
             return -1
-        if not b.has_legal_moves():
+        if np.all(board):
             return 0
         return None
 
@@ -145,8 +301,13 @@ class GomokuGame:
                 symmetries += [(newB, newPi.ravel())]
         return symmetries
 
+    def getSymmetryPerms(self):
+        """The 8 symmetries of the board as index permutations, see dihedral_perms"""
+        return dihedral_perms(self.n)
+
     def stringRepresentation(self, board):
-        return board.tostring()
+        # 64-bit Zobrist hash; Board keeps the same value up to date move by move
+        return zobrist_hash(board)
 
     @staticmethod
     def display(board, player1_first=True):
@@ -290,7 +451,7 @@ class RandomGomokuPlayer:
     def __init__(self, game):
         self.game = game
 
-    def play(self, board):
+    def play(self, board, last=-1):
         a = np.random.randint(self.game.getActionSize())
         valids = self.game.getValidMoves(board, 1)
         while valids[a] != 1:
@@ -302,7 +463,7 @@ class GreedyGomokuPlayer:
     def __init__(self, game):
         self.game = game
 
-    def play(self, board):
+    def play(self, board, last=-1):
         valids = self.game.getValidMoves(board, 1)
         candidates = []
         for a in range(self.game.getActionSize()):
@@ -320,7 +481,7 @@ class HumanGomokuPlayer:
         self.game = game
         self.gui = GomokuGUI(game.n)
 
-    def play(self, board):
+    def play(self, board, last=-1):
         valid = self.game.getValidMoves(board, 1)
         self.gui.draw_board(board)
         
@@ -351,7 +512,9 @@ class Arena:
     def __init__(self, player1, player2, game, display=None):
         """
         Input:
-            player 1,2: two functions that takes board as input, return action
+            player 1,2: two functions that take the canonical board and the
+                        opponent's last move (-1 before the first move) as
+                        input, return action
             game: Game object
             display: a function that takes board as input and prints it. Is necessary for verbose
                      mode.
@@ -382,7 +545,8 @@ class Arena:
             self.game.gui = GomokuGUI(len(board), self.player1_first)
         
         it = 0
-        while self.game.getGameEnded(board, curPlayer) is None:
+        action = None  # the last move, so only the lines through it are checked
+        while self.game.getGameEnded(board, curPlayer, action) is None:
             it += 1
             if verbose:
                 assert self.display
@@ -390,7 +554,7 @@ class Arena:
                 self.display(board, self.player1_first)  # Pass player order information
             
             action = players[curPlayer + 1](
-                self.game.getCanonicalForm(board, curPlayer)
+                self.game.getCanonicalForm(board, curPlayer), -1 if action is None else action
             )
 
             valids = self.game.getValidMoves(
@@ -403,14 +567,15 @@ class Arena:
                 assert valids[action] > 0
             
             board, curPlayer = self.game.getNextState(board, curPlayer, action)
-        
+
+        winner = curPlayer * self.game.getGameEnded(board, curPlayer, action)
         if verbose:
             assert self.display
             print("Game over: Turn ", str(it), "Result ", str(curPlayer))
             self.display(board, self.player1_first)  # Pass player order information
             
             if hasattr(self.game, 'gui'):
-                result = curPlayer * self.game.getGameEnded(board, curPlayer)
+                result = winner
                 if not self.player1_first:
                     result = -result
                 
@@ -427,16 +592,16 @@ class Arena:
                             pygame.quit()
                             sys.exit()
                     
-                    action = self.game.gui.handle_game_over_input()
-                    if action == "next" and not is_final_round:
+                    choice = self.game.gui.handle_game_over_input()
+                    if choice == "next" and not is_final_round:
                         break
-                    elif action == "quit":
+                    elif choice == "quit":
                         pygame.quit()
                         sys.exit()
                     
                     pygame.display.flip()
         
-        return curPlayer * self.game.getGameEnded(board, curPlayer)
+        return winner
 
     def playGames(self, num, verbose=False):
         """